@@ -0,0 +1,59 @@
+import asyncio
+
+
+class FakeGuild:
+    """権限チェックを素通りさせるためのギルド（Bot自身のメンバーは見つからない扱い）"""
+
+    def __init__(self, name="mock-guild"):
+        self.name = name
+        self.me = None
+
+
+class FakeChannel:
+    """channel.send を記録するだけのDiscordチャンネル"""
+
+    def __init__(self, channel_id, latency=0.0):
+        self.id = channel_id
+        self.guild = FakeGuild()
+        self.latency = latency  # 1回の送信の擬似遅延（秒）
+        self.sends = 0
+        self.embeds = 0
+
+    @property
+    def mention(self):
+        return f"<#{self.id}>"
+
+    async def send(self, content=None, *, embed=None, embeds=None):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.sends += 1
+        self.embeds += len(embeds) if embeds else (1 if embed else 0)
+
+    def reset(self):
+        self.sends = 0
+        self.embeds = 0
+
+
+class FakeDiscord:
+    """bot.get_channel の代わりに FakeChannel を返すシンク"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.channels = {}
+
+    def get_channel(self, channel_id):
+        channel = self.channels.get(channel_id)
+        if channel is None:
+            channel = FakeChannel(channel_id, self.latency)
+            self.channels[channel_id] = channel
+        return channel
+
+    def total_sends(self):
+        return sum(channel.sends for channel in self.channels.values())
+
+    def total_embeds(self):
+        return sum(channel.embeds for channel in self.channels.values())
+
+    def reset(self):
+        for channel in self.channels.values():
+            channel.reset()
@@ -0,0 +1,274 @@
+import asyncio
+import json
+import random
+import re
+import socket
+import time
+
+from aiohttp import web
+
+
+class MockTwitter:
+    """Twitter API v2 のローカルモック（ユーザー検索・タイムライン・recent search・フィルタードストリーム・レート制限ヘッダ）"""
+
+    def __init__(self, rate_limit=100000, window=900, error_rate=0.0, latency=0.0, media_ratio=0.3,
+                 keep_alive_interval=20.0):
+        self.rate_limit = rate_limit      # エンドポイントごとのウィンドウあたりリクエスト数
+        self.window = window
+        self.error_rate = error_rate      # ランダムに 429 を返す割合
+        self.latency = latency            # 1リクエストあたりの擬似遅延（秒）
+        self.media_ratio = media_ratio    # 画像付きツイートの割合
+        self.users = {}                   # username(小文字) -> (id, username)
+        self.timelines = {}               # user_id -> [tweet dict]（新しい順）
+        self.buckets = {}                 # endpoint -> [remaining, reset_at]
+        self.request_counts = {}
+        self.next_tweet_id = 0
+        self.keep_alive_interval = keep_alive_interval  # ストリームの keep-alive（空行）の間隔（秒）
+        self.stream_rules = {}            # rule_id -> {"id", "value", "tag"}
+        self.next_rule_id = 1
+        self.streams = set()              # 接続中ストリームごとの asyncio.Queue
+        self.stalled = False              # True の間は keep-alive も送らない（無通信の検知テスト用）
+        self.runner = None
+        self.url = None
+
+    # ---- データ生成 ----
+
+    def add_users(self, usernames):
+        for username in usernames:
+            if username.lower() not in self.users:
+                user_id = str(10_000 + len(self.users))
+                self.users[username.lower()] = (user_id, username)
+                self.timelines[user_id] = []
+
+    def publish(self, tweets_per_user):
+        """全ユーザーに新規ツイートを追加"""
+        for user_id, timeline in self.timelines.items():
+            for _ in range(tweets_per_user):
+                # 実際のAPIと同じく投稿時刻を含む Snowflake 形式のID
+                self.next_tweet_id = max(self.next_tweet_id + 1, (int(time.time() * 1000) - 1288834974657) << 22)
+                tweet = {
+                    "id": str(self.next_tweet_id),
+                    "text": f"Mock tweet {self.next_tweet_id} from {user_id}",
+                    "author_id": user_id,
+                    "created_at": time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime()),
+                }
+                if random.random() < self.media_ratio:
+                    tweet["attachments"] = {"media_keys": [f"3_{self.next_tweet_id}"]}
+                timeline.insert(0, tweet)
+                for stream in self.streams:
+                    stream.put_nowait(tweet)
+
+    def drop_streams(self):
+        """接続中のストリームをサーバー側から切断"""
+        for stream in self.streams:
+            stream.put_nowait(None)
+
+    def total_requests(self):
+        return sum(self.request_counts.values())
+
+    # ---- レート制限 ----
+
+    def _take(self, endpoint):
+        """レート制限を消費し、(ヘッダ, 429にするか) を返す"""
+        self.request_counts[endpoint] = self.request_counts.get(endpoint, 0) + 1
+        now = time.time()
+        bucket = self.buckets.get(endpoint)
+        if bucket is None or now >= bucket[1]:
+            bucket = [self.rate_limit, now + self.window]
+            self.buckets[endpoint] = bucket
+
+        limited = bucket[0] <= 0 or random.random() < self.error_rate
+        if not limited:
+            bucket[0] -= 1
+        headers = {
+            "x-rate-limit-limit": str(self.rate_limit),
+            "x-rate-limit-remaining": str(bucket[0]),
+            "x-rate-limit-reset": str(int(bucket[1])),
+        }
+        return headers, limited
+
+    async def _respond(self, endpoint, build):
+        headers, limited = self._take(endpoint)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if limited:
+            return web.json_response({"title": "Too Many Requests", "status": 429}, status=429, headers=headers)
+        return web.json_response(build(), headers=headers)
+
+    # ---- エンドポイント ----
+
+    async def users_by(self, request):
+        names = request.query.get("usernames", "").split(",")
+
+        def build():
+            data, errors = [], []
+            for name in names:
+                user = self.users.get(name.lower())
+                if user:
+                    data.append({"id": user[0], "username": user[1], "name": user[1]})
+                else:
+                    errors.append({"value": name, "detail": f"Could not find user with usernames: [{name}]."})
+            body = {"data": data}
+            if errors:
+                body["errors"] = errors
+            return body
+
+        return await self._respond("user_lookup", build)
+
+    async def user_by_username(self, request):
+        user = self.users.get(request.match_info["username"].lower())
+        if not user:
+            return web.json_response({"errors": [{"detail": "Not found"}]}, status=404)
+        return await self._respond("user_lookup", lambda: {"data": {"id": user[0], "username": user[1]}})
+
+    async def user_tweets(self, request):
+        timeline = self.timelines.get(request.match_info["user_id"], [])
+        max_results = int(request.query.get("max_results", 10))
+        since_id = request.query.get("since_id")
+        start_time = request.query.get("start_time")
+        offset = int(request.query.get("pagination_token", 0))
+
+        def build():
+            matched = [
+                t for t in timeline
+                if (not since_id or int(t["id"]) > int(since_id))
+                and (not start_time or t["created_at"][:19] >= start_time[:19])
+            ]
+            body = self._page(matched[offset:offset + max_results])
+            if offset + max_results < len(matched):
+                body["meta"]["next_token"] = str(offset + max_results)
+            return body
+
+        return await self._respond("user_tweets", build)
+
+    async def search_recent(self, request):
+        authors = {
+            self.users[name.lower()][0]
+            for name in re.findall(r"from:(\w+)", request.query.get("query", ""))
+            if name.lower() in self.users
+        }
+        max_results = int(request.query.get("max_results", 10))
+        since_id = request.query.get("since_id")
+        start_time = request.query.get("start_time")
+        offset = int(request.query.get("next_token", 0))
+
+        def build():
+            matched = sorted(
+                (t for author in authors for t in self.timelines[author]
+                 if (not since_id or int(t["id"]) > int(since_id))
+                 and (not start_time or t["created_at"][:19] >= start_time[:19])),
+                key=lambda t: int(t["id"]),
+                reverse=True,
+            )
+            page = matched[offset:offset + max_results]
+            body = self._page(page)
+            if offset + max_results < len(matched):
+                body["meta"]["next_token"] = str(offset + max_results)
+            return body
+
+        return await self._respond("search_recent", build)
+
+    async def get_stream_rules(self, request):
+        rules = list(self.stream_rules.values())
+        body = {"meta": {"result_count": len(rules)}}
+        if rules:
+            body["data"] = rules
+        return web.json_response(body)
+
+    async def post_stream_rules(self, request):
+        body = await request.json()
+        added = []
+        for rule in body.get("add", []):
+            rule_id = str(self.next_rule_id)
+            self.next_rule_id += 1
+            self.stream_rules[rule_id] = {"id": rule_id, "value": rule["value"], "tag": rule.get("tag")}
+            added.append(self.stream_rules[rule_id])
+        deleted = [rule_id for rule_id in body.get("delete", {}).get("ids", []) if self.stream_rules.pop(rule_id, None)]
+        return web.json_response({
+            "data": added,
+            "meta": {"summary": {"created": len(added), "deleted": len(deleted)}},
+        }, status=201 if added else 200)
+
+    def _matching_rules(self, tweet):
+        """ツイートの投稿者を from: に含むルール"""
+        author = next((name for name, (user_id, _) in self.users.items() if user_id == tweet["author_id"]), None)
+        return [
+            {"id": rule["id"], "tag": rule["tag"]}
+            for rule in self.stream_rules.values()
+            if author and author in {name.lower() for name in re.findall(r"from:(\w+)", rule["value"])}
+        ]
+
+    async def search_stream(self, request):
+        """1行1件のJSONを送り続けるストリーム（一定間隔で空行の keep-alive）"""
+        headers, limited = self._take("search_stream")
+        if limited:
+            return web.json_response({"title": "TooManyConnections", "status": 429}, status=429, headers=headers)
+
+        response = web.StreamResponse(headers={**headers, "Content-Type": "application/json"})
+        await response.prepare(request)
+        stream = asyncio.Queue()
+        self.streams.add(stream)
+        try:
+            while True:
+                try:
+                    tweet = await asyncio.wait_for(stream.get(), timeout=self.keep_alive_interval)
+                except asyncio.TimeoutError:
+                    if not self.stalled:
+                        await response.write(b"\r\n")
+                    continue
+                if tweet is None:
+                    break
+                rules = self._matching_rules(tweet)
+                if not rules:
+                    continue
+                body = {"data": tweet, "matching_rules": rules}
+                media = self._page([tweet]).get("includes")
+                if media:
+                    body["includes"] = media
+                await response.write(json.dumps(body).encode() + b"\r\n")
+        except (ConnectionResetError, asyncio.CancelledError):
+            pass
+        finally:
+            self.streams.discard(stream)
+        return response
+
+    def _page(self, tweets):
+        media = [
+            {"media_key": key, "type": "photo", "url": f"https://example.invalid/{key}.jpg"}
+            for tweet in tweets
+            for key in tweet.get("attachments", {}).get("media_keys", [])
+        ]
+        body = {"meta": {"result_count": len(tweets)}}
+        if tweets:
+            body["data"] = tweets
+            body["meta"]["newest_id"] = tweets[0]["id"]
+            body["meta"]["oldest_id"] = tweets[-1]["id"]
+        if media:
+            body["includes"] = {"media": media}
+        return body
+
+    # ---- サーバー ----
+
+    def make_app(self):
+        app = web.Application()
+        app.router.add_get("/2/users/by", self.users_by)
+        app.router.add_get("/2/users/by/username/{username}", self.user_by_username)
+        app.router.add_get("/2/users/{user_id}/tweets", self.user_tweets)
+        app.router.add_get("/2/tweets/search/recent", self.search_recent)
+        app.router.add_get("/2/tweets/search/stream/rules", self.get_stream_rules)
+        app.router.add_post("/2/tweets/search/stream/rules", self.post_stream_rules)
+        app.router.add_get("/2/tweets/search/stream", self.search_stream)
+        return app
+
+    async def start(self, host="127.0.0.1", port=0):
+        self.runner = web.AppRunner(self.make_app())
+        await self.runner.setup()
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind((host, port))
+        await web.SockSite(self.runner, sock).start()
+        self.url = f"http://{host}:{sock.getsockname()[1]}/2"
+        return self.url
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
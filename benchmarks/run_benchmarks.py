@@ -0,0 +1,262 @@
+"""モックの Twitter / Discord を使った check_and_post_updates のスループット計測
+
+ネットワークや実際のAPIクォータを使わずに、1回のチェックサイクルの
+レイテンシ・配信1件あたりのリクエスト数・メモリ・イベントループ遅延を計測する。
+
+    python benchmarks/run_benchmarks.py
+    python benchmarks/run_benchmarks.py --accounts 1 100 1000 --mode search --channels 3
+    python benchmarks/run_benchmarks.py --mode stream   # 投稿から配信までの時間（cycle s）を計測
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from fake_discord import FakeDiscord
+from mock_twitter import MockTwitter
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline throughput benchmark for the Twitter → Discord bot")
+    parser.add_argument("--accounts", type=int, nargs="+", default=[1, 100, 1000], help="監視アカウント数")
+    parser.add_argument("--tweets", type=int, default=3, help="計測サイクルで各アカウントが投稿するツイート数")
+    parser.add_argument("--mode", choices=["timeline", "search", "stream"], default="timeline", help="取得モード")
+    parser.add_argument("--channels", type=int, default=1, help="アカウントあたりの配信先チャンネル数")
+    parser.add_argument("--concurrency", type=int, default=20, help="POLL_CONCURRENCY")
+    parser.add_argument("--rate-limit", type=int, default=100000, help="モックのエンドポイントごとの15分あたりリクエスト数")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="モックがランダムに 429 を返す割合")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="モックAPIの擬似遅延（秒）")
+    parser.add_argument("--discord-latency", type=float, default=0.0, help="Discord送信の擬似遅延（秒）")
+    parser.add_argument("--verbose", action="store_true", help="Botのログを INFO で表示")
+    return parser.parse_args()
+
+
+def configure_environment(args, state_dir):
+    """bot をインポートする前に環境変数を設定"""
+    os.environ.update({
+        "DISCORD_TOKEN": "benchmark",
+        "CHANNEL_ID": "1",
+        "TWITTER_BEARER_TOKEN": "benchmark",
+        "TWITTER_API_BASE_URL": "http://127.0.0.1:1/2",  # シナリオごとにモックのURLへ差し替える
+        "STATE_DB_PATH": os.path.join(state_dir, "bench_state.db"),
+        "MONTHLY_TWEET_LIMIT": str(10 ** 9),
+        "DELIVERY_LINGER": "0.05",
+        "POLL_CONCURRENCY": str(args.concurrency),
+        "FETCH_MODE": args.mode,
+    })
+
+
+class LoopLagMonitor:
+    """一定間隔で sleep し、予定より遅れて起床した時間をイベントループ遅延として記録"""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.max_lag = 0.0
+        self.total_lag = 0.0
+        self.samples = 0
+        self.task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(loop.time() - started - self.interval, 0.0)
+            self.max_lag = max(self.max_lag, lag)
+            self.total_lag += lag
+            self.samples += 1
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+
+    @property
+    def mean_lag(self):
+        return self.total_lag / self.samples if self.samples else 0.0
+
+
+def reset_bot_state(bot, usernames, channel_ids, mock_url):
+    """シナリオごとに bot のモジュール状態を初期化"""
+    for delivery_queue in bot.delivery_queues.values():
+        if delivery_queue.worker:
+            delivery_queue.worker.cancel()
+    bot.delivery_queues.clear()
+
+    bot.TARGET_ACCOUNTS.clear()
+    bot.TARGET_ACCOUNTS.update({username: None for username in usernames})
+    bot.last_tweet_ids.clear()
+    bot.last_tweet_ids.update({username: None for username in usernames})
+    bot.last_checked_at.clear()
+    bot.skip_until.clear()
+    bot.ACCOUNT_ROUTES.clear()
+    if len(channel_ids) > 1:
+        bot.ACCOUNT_ROUTES.update({username: list(channel_ids) for username in usernames})
+
+    bot.rate_limiter.endpoints.clear()
+    bot.budget_tracker._reset_counters()
+    bot.twitter_api.base_url = mock_url
+
+
+async def run_scenario(bot, args, n_accounts):
+    mock = MockTwitter(rate_limit=args.rate_limit, error_rate=args.error_rate, latency=args.api_latency)
+    await mock.start()
+    discord_sink = FakeDiscord(latency=args.discord_latency)
+    bot.bot.get_channel = discord_sink.get_channel
+
+    usernames = [f"bench{n_accounts}_{i}" for i in range(n_accounts)]
+    channel_ids = [1000 + i for i in range(args.channels)] if args.channels > 1 else [1]
+    mock.add_users(usernames)
+    reset_bot_state(bot, usernames, channel_ids, mock.url)
+
+    try:
+        # コールドスタート（ユーザーID解決 + 最新1件の投稿）
+        mock.publish(1)
+        await bot.check_and_post_updates()
+
+        # 計測1: レイテンシ・リクエスト数・イベントループ遅延
+        mock.publish(args.tweets)
+        discord_sink.reset()
+        requests_before = mock.total_requests()
+        monitor = LoopLagMonitor()
+        monitor.start()
+        started = time.perf_counter()
+        await bot.check_and_post_updates()
+        elapsed = time.perf_counter() - started
+        await monitor.stop()
+        requests = mock.total_requests() - requests_before
+        delivered = discord_sink.total_embeds()
+        sends = discord_sink.total_sends()
+
+        # 計測2: メモリ（tracemalloc は遅くなるためレイテンシとは別のサイクルで計測）
+        mock.publish(args.tweets)
+        tracemalloc.start()
+        await bot.check_and_post_updates()
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    finally:
+        await bot.twitter_api.close()
+        await mock.stop()
+
+    return {
+        "accounts": n_accounts,
+        "cycle_seconds": elapsed,
+        "requests": requests,
+        "delivered": delivered,
+        "sends": sends,
+        "requests_per_tweet": requests / delivered if delivered else float("nan"),
+        "peak_memory_mb": peak_memory / (1024 * 1024),
+        "max_loop_lag_ms": monitor.max_lag * 1000,
+        "mean_loop_lag_ms": monitor.mean_lag * 1000,
+    }
+
+
+async def run_stream_scenario(bot, args, n_accounts):
+    """ストリームに接続した状態で投稿し、全件がDiscordに届くまでの時間を計測"""
+    mock = MockTwitter(rate_limit=args.rate_limit, latency=args.api_latency, keep_alive_interval=1.0)
+    await mock.start()
+    discord_sink = FakeDiscord(latency=args.discord_latency)
+    bot.bot.get_channel = discord_sink.get_channel
+
+    usernames = [f"bench{n_accounts}_{i}" for i in range(n_accounts)]
+    channel_ids = [1000 + i for i in range(args.channels)] if args.channels > 1 else [1]
+    mock.add_users(usernames)
+    reset_bot_state(bot, usernames, channel_ids, mock.url)
+    consumer = bot.stream_consumer
+    consumer.synced_rules = None
+
+    try:
+        # コールドスタート（ユーザーID解決 + 最新1件の投稿）後に接続し、接続時の補完が終わるまで待つ
+        mock.publish(1)
+        await bot.check_and_post_updates()
+        consumer.start()
+        while not consumer.connected:
+            await asyncio.sleep(0.01)
+        await consumer.incoming.join()
+
+        discord_sink.reset()
+        requests_before = mock.total_requests()
+        expected = n_accounts * args.tweets * len(channel_ids)
+        monitor = LoopLagMonitor()
+        monitor.start()
+        started = time.perf_counter()
+        mock.publish(args.tweets)
+        while discord_sink.total_embeds() < expected and time.perf_counter() - started < 60:
+            await asyncio.sleep(0.005)
+        elapsed = time.perf_counter() - started
+        await monitor.stop()
+        requests = mock.total_requests() - requests_before
+        delivered = discord_sink.total_embeds()
+    finally:
+        for task in (consumer.task, consumer.worker):
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        consumer.connected = False
+        await bot.twitter_api.close()
+        await mock.stop()
+
+    return {
+        "accounts": n_accounts,
+        "cycle_seconds": elapsed,
+        "requests": requests,
+        "delivered": delivered,
+        "sends": discord_sink.total_sends(),
+        "requests_per_tweet": requests / delivered if delivered else float("nan"),
+        "peak_memory_mb": float("nan"),
+        "max_loop_lag_ms": monitor.max_lag * 1000,
+        "mean_loop_lag_ms": monitor.mean_lag * 1000,
+    }
+
+
+def print_results(args, results):
+    print(f"\nmode={args.mode} channels={args.channels} tweets/account={args.tweets} "
+          f"concurrency={args.concurrency} error_rate={args.error_rate}")
+    header = f"{'accounts':>8} {'cycle s':>9} {'requests':>9} {'delivered':>10} {'sends':>7} " \
+             f"{'req/tweet':>10} {'peak MB':>8} {'max lag ms':>11} {'mean lag ms':>12}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(f"{r['accounts']:>8} {r['cycle_seconds']:>9.3f} {r['requests']:>9} {r['delivered']:>10} "
+              f"{r['sends']:>7} {r['requests_per_tweet']:>10.3f} {r['peak_memory_mb']:>8.2f} "
+              f"{r['max_loop_lag_ms']:>11.2f} {r['mean_loop_lag_ms']:>12.3f}")
+
+
+async def main():
+    args = parse_args()
+    with tempfile.TemporaryDirectory() as state_dir:
+        configure_environment(args, state_dir)
+        import bot
+
+        logging.getLogger().setLevel(logging.INFO if args.verbose else logging.WARNING)
+
+        # ゲートウェイに接続しないので ready 待ちは不要
+        async def ready():
+            return None
+        bot.bot.wait_until_ready = ready
+
+        results = []
+        scenario = run_stream_scenario if args.mode == "stream" else run_scenario
+        for n_accounts in args.accounts:
+            results.append(await scenario(bot, args, n_accounts))
+        print_results(args, results)
+        bot.state_store.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
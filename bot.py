@@ -2,21 +2,132 @@ skip_until = {}
 
 import os
 import discord
-from discord.ext import tasks, commands
+from discord import app_commands
+from discord.ext import commands
 import aiohttp
 import asyncio
+import contextlib
 import logging
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import json
+import math
+import random
+import time
+import heapq
+import itertools
+import socket
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from state_store import StateStore
+from metrics import REGISTRY, Counter, Gauge, Histogram
+from keep_alive import keep_alive
+from logging_setup import sampled, setup_logging
+from tweet_filter import TweetFilter
 
-# ログ設定
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# ログ設定（出力は別スレッドで行い、繰り返しの多い行は sampled() で間引く）
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")                       # json / text
+LOG_MAX_MESSAGE_LENGTH = int(os.environ.get("LOG_MAX_MESSAGE_LENGTH", "2000"))  # レスポンス本文などはこの文字数で切り詰める
+LOG_SAMPLE_BURST = int(os.environ.get("LOG_SAMPLE_BURST", "20"))        # 間引き対象の行をウィンドウ内でそのまま出す件数
+LOG_SAMPLE_WINDOW = float(os.environ.get("LOG_SAMPLE_WINDOW", "60"))    # 間引きのウィンドウ（秒）
+LOG_SAMPLE_EVERY = int(os.environ.get("LOG_SAMPLE_EVERY", "100"))       # 上限を超えた後は何件に1件出すか
+log_listener = setup_logging(
+    LOG_LEVEL, LOG_FORMAT, LOG_MAX_MESSAGE_LENGTH, LOG_SAMPLE_BURST, LOG_SAMPLE_WINDOW, LOG_SAMPLE_EVERY
+)
 logger = logging.getLogger(__name__)
 
 # 環境変数
 DISCORD_TOKEN = os.environ.get("DISCORD_TOKEN")
 CHANNEL_ID = int(os.environ.get("CHANNEL_ID")) if os.environ.get("CHANNEL_ID") else None
 TWITTER_BEARER_TOKEN = os.environ.get("TWITTER_BEARER_TOKEN")
+TWITTER_API_BASE_URL = os.environ.get("TWITTER_API_BASE_URL", "https://api.twitter.com/2")  # ローカルのモックサーバー用に変更可能
+
+# 配信方法: "gateway"（Botとしてゲートウェイに接続し、管理コマンドも使える）または
+# "webhook"（ゲートウェイに接続せず Webhook で送信するだけの軽量モード。DISCORD_TOKEN 不要、コマンドは使えない）
+DELIVERY_MODE = os.environ.get("DELIVERY_MODE", "gateway")
+
+# HTTP接続プール設定（Twitter API用の共有セッション）
+HTTP_CONNECTION_LIMIT = int(os.environ.get("HTTP_CONNECTION_LIMIT", "20"))
+HTTP_CONNECTION_LIMIT_PER_HOST = int(os.environ.get("HTTP_CONNECTION_LIMIT_PER_HOST", "4"))
+HTTP_DNS_CACHE_TTL = int(os.environ.get("HTTP_DNS_CACHE_TTL", "300"))        # DNSキャッシュ保持秒数
+HTTP_KEEPALIVE_TIMEOUT = float(os.environ.get("HTTP_KEEPALIVE_TIMEOUT", "60"))  # アイドル接続の保持秒数
+HTTP_TOTAL_TIMEOUT = float(os.environ.get("HTTP_TOTAL_TIMEOUT", "30"))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", "10"))
+HTTP_READ_TIMEOUT = float(os.environ.get("HTTP_READ_TIMEOUT", "20"))
+
+# 状態の永続化先（ユーザーID・最終ツイートID・レート制限カウンタ）
+STATE_DB_PATH = os.environ.get("STATE_DB_PATH", "bot_state.db")
+
+# ユーザー名→ID一括変換の1リクエストあたりの件数（APIの上限は100）
+USER_LOOKUP_BATCH_SIZE = 100
+
+# 同時にツイート取得を行うアカウント数の上限
+POLL_CONCURRENCY = int(os.environ.get("POLL_CONCURRENCY", "5"))
+
+# Discord送信キュー設定
+DELIVERY_BATCH_SIZE = 10          # 1メッセージあたりの埋め込み数（Discordの上限は10）
+DELIVERY_MAX_EMBED_CHARS = 6000   # 1メッセージ内の埋め込み合計文字数の上限
+DELIVERY_LINGER = float(os.environ.get("DELIVERY_LINGER", "1.0"))  # 後続の埋め込みをまとめるための待機秒数
+DELIVERY_MAX_RETRIES = int(os.environ.get("DELIVERY_MAX_RETRIES", "3"))
+DELIVERY_DEDUP_SIZE = int(os.environ.get("DELIVERY_DEDUP_SIZE", "1000"))  # 配信先ごとに覚えておく送信済みツイートID数
+
+# アダプティブポーリング設定（秒）
+POLL_DEFAULT_INTERVAL = int(os.environ.get("POLL_DEFAULT_INTERVAL", str(3 * 3600)))  # 投稿頻度が分かるまでの間隔
+POLL_MIN_INTERVAL = int(os.environ.get("POLL_MIN_INTERVAL", str(15 * 60)))
+POLL_MAX_INTERVAL = int(os.environ.get("POLL_MAX_INTERVAL", str(12 * 3600)))
+POLL_TARGET_TWEETS = float(os.environ.get("POLL_TARGET_TWEETS", "1"))  # 1回のポーリングで見込む新規ツイート数
+POLL_RATE_SMOOTHING = 0.3  # 投稿頻度の指数移動平均の係数
+
+# サーキットブレーカー（失敗が続くアカウント・エンドポイントを一時的に切り離す）
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get("BREAKER_FAILURE_THRESHOLD", "3"))  # 連続失敗がこの回数に達したら遮断
+BREAKER_BASE_DELAY = float(os.environ.get("BREAKER_BASE_DELAY", "60"))             # 最初の遮断時間（秒）、以降は倍々に延長
+ACCOUNT_BREAKER_MAX_DELAY = float(os.environ.get("ACCOUNT_BREAKER_MAX_DELAY", str(6 * 3600)))
+ENDPOINT_BREAKER_MAX_DELAY = float(os.environ.get("ENDPOINT_BREAKER_MAX_DELAY", "900"))
+BREAKER_PROBE_TIMEOUT = 120  # half-open の試行がこの秒数で結果を返さなければ次の試行を許可
+
+# 月間予算設定
+MONTHLY_TWEET_LIMIT = int(os.environ.get("MONTHLY_TWEET_LIMIT", "10000"))
+BILLING_CYCLE_DAY = min(max(int(os.environ.get("BILLING_CYCLE_DAY", "1")), 1), 28)  # 請求サイクルの開始日
+BUDGET_SPEND_CEILING = float(os.environ.get("BUDGET_SPEND_CEILING", "0.9"))  # 予測使用量の上限（月間上限に対する割合）
+BUDGET_MIN_PRESSURE = 0.5  # 予算に余裕がある時にポーリング間隔を縮める下限倍率
+BUDGET_MAX_PRESSURE = 8.0  # 予算超過が見込まれる時にポーリング間隔を広げる上限倍率
+
+# 取得モード: "timeline"（アカウントごとに /users/:id/tweets）、
+# "search"（/tweets/search/recent に from:a OR from:b ... でまとめて問い合わせ）または
+# "stream"（/tweets/search/stream に接続し、投稿を数秒で受け取る。切断中の分はタイムラインで補完）
+FETCH_MODE = os.environ.get("FETCH_MODE", "timeline")
+SEARCH_QUERY_MAX_LENGTH = int(os.environ.get("SEARCH_QUERY_MAX_LENGTH", "512"))  # プランごとのクエリ長上限
+SEARCH_MAX_PAGES = int(os.environ.get("SEARCH_MAX_PAGES", "5"))  # 1クエリあたりに辿るページ数の上限
+SEARCH_WINDOW = 7 * 24 * 3600 - 300  # recent search で遡れる範囲（秒）。境界で拒否されないよう少し短くする
+
+# フィルタードストリーム設定
+STREAM_RULE_MAX_LENGTH = int(os.environ.get("STREAM_RULE_MAX_LENGTH", "512"))       # プランごとのルール長上限
+STREAM_RULE_TAG = "twitter-discord-bot"                                            # このBotが管理するルールの目印
+STREAM_HEARTBEAT_TIMEOUT = float(os.environ.get("STREAM_HEARTBEAT_TIMEOUT", "30"))  # この秒数データ（keep-alive含む）が無ければ切断とみなす
+STREAM_BACKOFF_BASE = float(os.environ.get("STREAM_BACKOFF_BASE", "1"))            # 再接続待ちの初期値（秒）、失敗が続くと倍々に延長
+STREAM_BACKOFF_MAX = float(os.environ.get("STREAM_BACKOFF_MAX", "320"))
+STREAM_RESYNC_INTERVAL = float(os.environ.get("STREAM_RESYNC_INTERVAL", "60"))      # 配信に失敗したアカウントをタイムラインから取り直す間隔（秒）
+
+# 停止後の取りこぼし回収（キャッチアップ）
+CATCHUP_BUDGET_SHARE = float(os.environ.get("CATCHUP_BUDGET_SHARE", "0.05"))  # 1アカウントの回収に使える残り月間予算の割合
+CATCHUP_PAGE_SIZE = 100   # 回収時の1ページあたりの取得件数（APIの上限）
+CATCHUP_POST_BATCH = 50   # 退避したツイートを投稿キューへ積む単位
+
+# ヘルスチェック・メトリクス用HTTPサーバー
+HEALTH_HOST = os.environ.get("HEALTH_HOST", "0.0.0.0")
+HEALTH_PORT = int(os.environ.get("PORT", "8080"))
+POLL_STALL_SECONDS = int(os.environ.get("POLL_STALL_SECONDS", "1800"))  # 予定時刻をこれ以上過ぎたら停止とみなす
+STATUS_REFRESH_INTERVAL = float(os.environ.get("STATUS_REFRESH_INTERVAL", "30"))  # ステータス用スナップショットの更新間隔（秒）
+
+# 複数プロセスでの分担（同じ STATE_DB_PATH を共有するワーカー間でアカウントをリースで分ける）
+SHARDING = os.environ.get("SHARDING", "false").lower() == "true"
+WORKER_ID = os.environ.get("WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}"
+SHARD_LEASE_TTL = int(os.environ.get("SHARD_LEASE_TTL", "60"))           # 更新が途絶えたワーカーのリースを失効させる秒数
+SHARD_RENEW_INTERVAL = int(os.environ.get("SHARD_RENEW_INTERVAL", "20"))  # リース更新・予算同期の間隔（秒）
+
+# 手動チェックジョブ
+MAX_CHECK_JOBS = 20               # 保持しておくジョブ履歴の件数
+SLASH_FOLLOWUP_TIMEOUT = 14 * 60  # スラッシュコマンドで完了通知を待つ秒数（インタラクションの有効期限は15分）
 
 # 🎯 監視対象のアカウント（angorou7を無効化）
 TARGET_ACCOUNTS = {
@@ -25,493 +136,2864 @@ TARGET_ACCOUNTS = {
     # "他のアカウント名": None,  # ← 追加したい場合
 }
 
-# Botインスタンス
-intents = discord.Intents.default()
-intents.message_content = True  # メッセージ内容を読み取るため
-bot = commands.Bot(command_prefix="!", intents=intents)
+# 配信先ルーティング（アカウント → 複数サーバーの複数チャンネル）
+# 未指定のアカウントは CHANNEL_ID に配信、環境変数 ACCOUNT_ROUTES（JSON）でも指定可能
+ACCOUNT_ROUTES = {
+    # "CryptoJPTrans": [123456789012345678, 234567890123456789],
+}
+ACCOUNT_ROUTES.update({
+    username: [int(channel_id) for channel_id in channel_ids]
+    for username, channel_ids in json.loads(os.environ.get("ACCOUNT_ROUTES", "{}")).items()
+})
+
+# ツイートの絞り込みルール（アカウント別・配信先チャンネル別）
+# include: いずれかを含むツイートだけ配信 / exclude: いずれかを含むツイートは配信しない / media_only: 画像・動画付きのみ
+# 語は大文字小文字を区別しない部分一致、"re:" で始まる語は正規表現。環境変数 ACCOUNT_FILTERS / CHANNEL_FILTERS（JSON）でも指定可能
+ACCOUNT_FILTERS = {
+    # "CryptoJPTrans": {"include": ["BTC", "re:\\bETH\\d*\\b"], "exclude": ["PR"]},
+}
+ACCOUNT_FILTERS.update(json.loads(os.environ.get("ACCOUNT_FILTERS", "{}")))
+CHANNEL_FILTERS = {
+    # 123456789012345678: {"media_only": True},
+}
+CHANNEL_FILTERS.update({
+    int(channel_id): rule
+    for channel_id, rule in json.loads(os.environ.get("CHANNEL_FILTERS", "{}")).items()
+})
+
+# アカウントごとのポーリング間隔（秒）の下限・上限（未指定はデフォルト値）
+ACCOUNT_POLL_INTERVALS = {
+    # "CryptoJPTrans": (600, 3 * 3600),  # ← 10分〜3時間で調整
+}
+
+# Webhook 配信先（DELIVERY_MODE=webhook、チャンネルID → Webhook URL）
+# CHANNEL_ID の Webhook は環境変数 WEBHOOK_URL、それ以外は環境変数 CHANNEL_WEBHOOKS（JSON）でも指定可能
+CHANNEL_WEBHOOKS = {
+    # 123456789012345678: "https://discord.com/api/webhooks/...",
+}
+CHANNEL_WEBHOOKS.update({
+    int(channel_id): url
+    for channel_id, url in json.loads(os.environ.get("CHANNEL_WEBHOOKS", "{}")).items()
+})
+if CHANNEL_ID and os.environ.get("WEBHOOK_URL"):
+    CHANNEL_WEBHOOKS.setdefault(CHANNEL_ID, os.environ["WEBHOOK_URL"])
+
+# Botインスタンス
+intents = discord.Intents.default()
+intents.message_content = True  # メッセージ内容を読み取るため
+
+
+class CommandTree(app_commands.CommandTree):
+    async def interaction_check(self, interaction):
+        # 複数ワーカー構成ではリーダーだけがスラッシュコマンドに応答する
+        return shard_coordinator.is_leader()
+
+
+bot = commands.Bot(command_prefix="!", intents=intents, tree_cls=CommandTree)
+
+# 最新ツイートIDの保存
+last_tweet_ids = {account: None for account in TARGET_ACCOUNTS}
+
+# 最後に取得して全件配信できた時刻（since_id が無い場合の start_time に使用）
+last_checked_at = {}
+
+# 配信に失敗して位置が止まっているアカウント（ストリームはこれらを直接配信せず、タイムラインから取り直す）
+delivery_backlog = set()
+
+# 検索モードでアカウントを含むクエリが最後に返した最新のツイートID（次回の since_id の候補）
+# 投稿の無いアカウントでも検索のたびに進むので、休眠アカウントが since_id を古いまま引き止めない
+search_since_ids = {}
+
+# レート制限管理（エンドポイント単位 + レスポンスヘッダ同期）
+class EndpointLimiter:
+    """1エンドポイント分のレート制限（スライディングウィンドウ、ヘッダ情報を優先）"""
+
+    def __init__(self, name, requests_per_window, window_duration):
+        self.name = name
+        self.requests_per_window = requests_per_window
+        self.window_duration = window_duration
+        self.requests = deque()  # 送信時刻（epoch秒）、古い順
+        self.remaining = None    # x-rate-limit-remaining
+        self.reset_at = None     # x-rate-limit-reset（epoch秒）
+        self.sent = 0            # 送信したリクエストの通し番号（レスポンスの前後関係の判定用）
+        self.synced_ticket = 0   # 残り回数を反映済みのレスポンスのうち最も新しいリクエストの番号
+        self._lock = asyncio.Lock()  # 待機中の呼び出し元を到着順に処理する
+        self._updated = asyncio.Event()  # ヘッダ同期で待機を打ち切るための通知
+
+    def _wait_time(self, now):
+        """次のリクエストまでに必要な待機秒数（0なら即時送信可）"""
+        cutoff = now - self.window_duration
+        while self.requests and self.requests[0] <= cutoff:
+            self.requests.popleft()
+
+        # APIが返した残り回数が有効ならそれに従う
+        if self.reset_at is not None:
+            if now >= self.reset_at:
+                self.remaining = None
+                self.reset_at = None
+            elif self.remaining is not None:
+                return 0 if self.remaining > 0 else self.reset_at - now
+
+        if len(self.requests) < self.requests_per_window:
+            return 0
+        return self.requests[0] + self.window_duration - now
+
+    async def acquire(self):
+        """送信枠を1つ確保（必要なら枠が空くまで待機）し、リクエストの通し番号を返す"""
+        async with self._lock:
+            waited_since = None
+            while True:
+                wait_time = self._wait_time(time.time())
+                if wait_time <= 0:
+                    break
+                # ヘッダ同期ですぐに解除されることが多いので、実際に待った時間は待機後に記録する
+                logger.debug(f"Rate limit reached for {self.name}. Waiting up to {wait_time:.1f} seconds...")
+                if waited_since is None:
+                    waited_since = time.monotonic()
+                # ヘッダで枠が増えた場合はすぐに再判定する
+                self._updated.clear()
+                try:
+                    await asyncio.wait_for(self._updated.wait(), wait_time)
+                except asyncio.TimeoutError:
+                    pass
+
+            if waited_since is not None:
+                waited = time.monotonic() - waited_since
+                if waited >= 1:
+                    logger.warning(f"Rate limit for {self.name} delayed a request by {waited:.1f} seconds")
+
+            self.requests.append(time.time())
+            if self.remaining is not None:
+                self.remaining -= 1
+            self.sent += 1
+            return self.sent
+
+    def update_from_headers(self, headers, ticket=None):
+        """x-rate-limit-* ヘッダから制限値・残り回数・リセット時刻を同期
+
+        ticket は acquire が返したリクエストの通し番号。それより後に送ったリクエストは
+        サーバーの残り回数にまだ含まれていない可能性があるため差し引き、
+        より新しいリクエストの結果を反映済みなら残り回数は上書きしない。
+        """
+        try:
+            limit = headers.get("x-rate-limit-limit")
+            remaining = headers.get("x-rate-limit-remaining")
+            reset = headers.get("x-rate-limit-reset")
+            if limit is not None:
+                self.requests_per_window = int(limit)
+            if remaining is not None and reset is not None:
+                if ticket is None:
+                    self.remaining = int(remaining)
+                    self.reset_at = float(reset)
+                elif ticket > self.synced_ticket:
+                    in_flight = self.sent - ticket
+                    self.remaining = max(int(remaining) - in_flight, 0)
+                    self.reset_at = float(reset)
+                    self.synced_ticket = ticket
+            self._updated.set()
+        except (TypeError, ValueError):
+            logger.warning(f"Invalid rate limit headers for {self.name}: {dict(headers)}")
+
+    def used_in_window(self):
+        """現在のウィンドウ内で使用したリクエスト数"""
+        self._wait_time(time.time())
+        if self.remaining is not None:
+            return max(self.requests_per_window - self.remaining, 0)
+        return len(self.requests)
+
+    def next_reset(self):
+        """次に枠が空く時刻（epoch秒）、空きがあれば None"""
+        if self.reset_at is not None:
+            return self.reset_at
+        if self.requests:
+            return self.requests[0] + self.window_duration
+        return None
+
+    def to_state(self):
+        return {
+            "requests_per_window": self.requests_per_window,
+            "requests": list(self.requests),
+            "remaining": self.remaining,
+            "reset_at": self.reset_at,
+        }
+
+    def load_state(self, state):
+        self.requests_per_window = state.get("requests_per_window", self.requests_per_window)
+        self.requests = deque(state.get("requests", []))
+        self.remaining = state.get("remaining")
+        self.reset_at = state.get("reset_at")
+
+
+class RateLimiter:
+    def __init__(self):
+        # ヘッダを受け取るまでの初期値（Twitter API v2 無料プラン: 15分あたり10リクエスト）
+        self.requests_per_window = 10
+        self.window_duration = 900     # 15分 = 900秒
+        self.endpoints = {}
+
+    def endpoint(self, name):
+        """エンドポイント名に対応するリミッターを取得（無ければ作成）"""
+        limiter = self.endpoints.get(name)
+        if limiter is None:
+            limiter = EndpointLimiter(name, self.requests_per_window, self.window_duration)
+            self.endpoints[name] = limiter
+        return limiter
+
+    async def wait_if_needed(self, endpoint):
+        """必要に応じて待機し、送信したリクエストの通し番号を返す（レスポンス時に update_from_headers へ渡す）
+
+        月間制限に達しているかエンドポイントが遮断中なら待たずに None を返す。
+        """
+        # 月間制限チェック（実際に取得したツイート数で計算）
+        if not budget_tracker.can_spend():
+            logger.error("Monthly tweet limit exceeded! Waiting until next billing cycle...")
+            return None
+
+        # 429 やエラーが続いているエンドポイントは待機せずに切り離す
+        breaker = endpoint_breakers.get(endpoint)
+        if not breaker.allow():
+            logger.warning(f"Circuit for {endpoint} is {breaker.state}, skipping request ({breaker.retry_after():.0f}s left)")
+            return None
+
+        try:
+            ticket = await self.endpoint(endpoint).acquire()
+        except BaseException:
+            # 待機中に取り消されたら送信していないので試行枠を返す
+            breaker.release_probe()
+            raise
+        logger.info("API Request to %s (%d/%d tweets this cycle)", endpoint,
+                    budget_tracker.tweets, budget_tracker.monthly_limit, extra=sampled("api_request"))
+        return ticket
+
+    def update_from_headers(self, endpoint, headers, ticket=None):
+        """レスポンスヘッダでエンドポイントの制限状態を更新"""
+        self.endpoint(endpoint).update_from_headers(headers, ticket)
+
+    def to_state(self):
+        """永続化用に状態を辞書で返す"""
+        return {
+            "endpoints": {name: limiter.to_state() for name, limiter in self.endpoints.items()},
+        }
+
+    def load_state(self, state):
+        """保存済みの状態を復元"""
+        if not state:
+            return
+        for name, endpoint_state in state.get("endpoints", {}).items():
+            self.endpoint(name).load_state(endpoint_state)
+
+
+# サーキットブレーカー（アカウント単位・エンドポイント単位）
+class CircuitBreaker:
+    """closed → (失敗が続く) → open → (待機後) → half-open →（試行が成功）→ closed
+
+    open の間は呼び出しを待たせずに拒否する。遮断時間は指数バックオフ＋ジッタで、
+    x-rate-limit-reset が分かる場合はその時刻を下限にする。
+    """
+
+    def __init__(self, name, failure_threshold, base_delay, max_delay):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.state = "closed"
+        self.failures = 0        # 連続失敗回数
+        self.trips = 0           # 連続で open になった回数（バックオフの指数）
+        self.opened_until = 0.0  # epoch秒
+        self.probe_started = None
+
+    def available(self):
+        """遮断中でないか（half-open の試行枠は消費しない）"""
+        return self.state != "open" or time.time() >= self.opened_until
+
+    def allow(self):
+        """呼び出してよいか。half-open では同時に1件だけ試行を許可する"""
+        now = time.time()
+        if self.state == "closed":
+            return True
+        if self.state == "open":
+            if now < self.opened_until:
+                return False
+            self.state = "half_open"
+            self.probe_started = None
+        if self.probe_started is not None and now - self.probe_started < BREAKER_PROBE_TIMEOUT:
+            return False
+        self.probe_started = now
+        return True
+
+    def release_probe(self):
+        """half-open の試行枠を結果を記録せずに返す（送信しなかった・結果がこのブレーカーに無関係な場合）"""
+        if self.state == "half_open":
+            self.probe_started = None
+
+    def record_success(self):
+        if self.state != "closed":
+            logger.info(f"Circuit for {self.name} closed")
+        self.state = "closed"
+        self.failures = 0
+        self.trips = 0
+        self.probe_started = None
+
+    def record_failure(self, retry_at=None):
+        """失敗を記録（retry_at を渡すと閾値に関係なくその時刻まで遮断）"""
+        self.failures += 1
+        if self.state == "open":
+            # 遮断前に送ったリクエストの失敗はバックオフを延ばさず、リセット時刻だけ反映する
+            if retry_at is not None and retry_at > self.opened_until:
+                self.opened_until = retry_at
+            return
+        if retry_at is not None or self.state == "half_open" or self.failures >= self.failure_threshold:
+            self.trip(retry_at)
+
+    def trip(self, retry_at=None):
+        now = time.time()
+        self.trips += 1
+        backoff = min(self.base_delay * 2 ** (self.trips - 1), self.max_delay)
+        if retry_at is not None:
+            # リセット時刻までは確実に待ち、同時に再開しないよう揺らぎを足す
+            delay = max(retry_at - now, 0) + random.uniform(0, min(backoff, self.base_delay))
+        else:
+            delay = random.uniform(backoff / 2, backoff)
+        self.state = "open"
+        self.opened_until = now + delay
+        self.probe_started = None
+        logger.warning(f"Circuit for {self.name} opened for {delay:.0f}s (trip {self.trips}, {self.failures} failures)")
+
+    def retry_after(self):
+        """遮断が解けるまでの秒数"""
+        if self.state != "open":
+            return 0.0
+        return max(self.opened_until - time.time(), 0.0)
+
+    def to_state(self):
+        return {"state": self.state, "trips": self.trips, "opened_until": self.opened_until}
+
+    def load_state(self, state):
+        # half-open の試行中だった場合は open として復元し、期限が来たら改めて試行する
+        self.state = "open" if state.get("state") != "closed" else "closed"
+        self.trips = state.get("trips", 0)
+        self.opened_until = state.get("opened_until", 0.0)
+
+
+class CircuitBreakers:
+    """キーごとの CircuitBreaker を必要になった時点で作成して保持"""
+
+    def __init__(self, scope, failure_threshold, base_delay, max_delay):
+        self.scope = scope
+        self.failure_threshold = failure_threshold
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breakers = {}
+
+    def get(self, key):
+        breaker = self.breakers.get(key)
+        if breaker is None:
+            breaker = CircuitBreaker(f"{self.scope} {key}", self.failure_threshold, self.base_delay, self.max_delay)
+            self.breakers[key] = breaker
+        return breaker
+
+    def open_circuits(self):
+        """遮断中・試行中のブレーカー {key: CircuitBreaker}"""
+        return {key: breaker for key, breaker in self.breakers.items() if breaker.state != "closed"}
+
+    def to_state(self):
+        return {key: breaker.to_state() for key, breaker in self.open_circuits().items()}
+
+    def load_state(self, state):
+        for key, breaker_state in (state or {}).items():
+            self.get(key).load_state(breaker_state)
+
+
+def record_api_result(endpoint, status, headers=None, username=None):
+    """レスポンスのステータス（例外時は None）をエンドポイント・アカウントのブレーカーに反映
+
+    ウィンドウを使い切った 429 はアプリ単位の制限なのでエンドポイントを x-rate-limit-reset まで遮断し、
+    5xx・通信エラーは両方に、404 などアカウント固有のエラーはアカウントにだけ数える。
+    """
+    endpoint_breaker = endpoint_breakers.get(endpoint)
+    account_breaker = account_breakers.get(username) if username else None
+
+    if status == 200:
+        endpoint_breaker.record_success()
+        if account_breaker:
+            account_breaker.record_success()
+    elif status == 429:
+        headers = headers or {}
+        reset = headers.get("x-rate-limit-reset")
+        if headers.get("x-rate-limit-remaining") in (None, "0"):
+            endpoint_breaker.record_failure(retry_at=float(reset) if reset else time.time() + 900)
+            if account_breaker:
+                account_breaker.release_probe()
+        else:
+            # ウィンドウに残りがあるのに 429 の場合は一時的なものとして通常の失敗と同様に数える
+            endpoint_breaker.record_failure()
+            if account_breaker:
+                account_breaker.record_failure()
+    elif status == 401:
+        endpoint_breaker.trip()
+        if account_breaker:
+            account_breaker.release_probe()
+    elif status is None or status >= 500:
+        endpoint_breaker.record_failure()
+        if account_breaker:
+            account_breaker.record_failure()
+    elif account_breaker:
+        account_breaker.record_failure()
+
+    # アカウントの遮断状態は skip_until として永続化する
+    if account_breaker:
+        if account_breaker.state == "open":
+            skip_until[username] = datetime.utcfromtimestamp(account_breaker.opened_until)
+        else:
+            skip_until.pop(username, None)
+
+
+# 月間予算管理（請求サイクル単位で実績を記録し、月末の使用量を予測）
+class BudgetTracker:
+    """リクエストごと・アカウントごとの取得ツイート数を記録し、サイクル末の使用量を予測する"""
+
+    def __init__(self, monthly_limit, cycle_day, spend_ceiling):
+        self.monthly_limit = monthly_limit
+        self.cycle_day = cycle_day
+        self.spend_ceiling = spend_ceiling  # 予測使用量をこの割合以内に抑える
+        self.cycle_start, self.cycle_end = self.cycle_bounds(datetime.utcnow())
+        self.tracking_started = datetime.utcnow()
+        self._reset_counters()
+
+    def _reset_counters(self):
+        self.requests = 0
+        self.tweets = 0
+        self.accounts = {}  # username -> {"requests": n, "tweets": n}
+        self.daily = {}     # "YYYY-MM-DD" -> 取得ツイート数
+        self.unsynced = {}  # "YYYY-MM-DD" -> [リクエスト数, ツイート数]（共有ストアへ未反映の分）
+
+    def cycle_bounds(self, now):
+        """now を含む請求サイクルの開始・終了時刻（UTC）"""
+        start = now.replace(day=self.cycle_day, hour=0, minute=0, second=0, microsecond=0)
+        if now < start:
+            start = _add_months(start, -1)
+        return start, _add_months(start, 1)
+
+    def _roll_cycle(self):
+        """サイクルが変わっていればカウンタをリセット"""
+        now = datetime.utcnow()
+        if now >= self.cycle_end:
+            logger.info(f"Billing cycle ended ({self.tweets} tweets used). Resetting budget counters.")
+            self.cycle_start, self.cycle_end = self.cycle_bounds(now)
+            self.tracking_started = now
+            self._reset_counters()
+
+    def record(self, endpoint, tweets, username=None, requests=1):
+        """1リクエスト分の実績（meta.result_count）を記録（ストリームで受け取った分は requests=0）"""
+        self._roll_cycle()
+        self.requests += requests
+        self.tweets += tweets
+        day = datetime.utcnow().strftime("%Y-%m-%d")
+        self.daily[day] = self.daily.get(day, 0) + tweets
+        pending = self.unsynced.setdefault(day, [0, 0])
+        pending[0] += requests
+        pending[1] += tweets
+        if username is not None:
+            account = self.accounts.setdefault(username, {"requests": 0, "tweets": 0})
+            account["requests"] += requests
+            account["tweets"] += tweets
+        if tweets:
+            logger.info("Billed %d tweets from %s (%d/%d this cycle)", tweets, endpoint,
+                        self.tweets, self.monthly_limit, extra=sampled("billed"))
+
+    def attribute(self, username, tweets):
+        """まとめて取得したリクエストの取得数をアカウントに割り当てる（合計には加算しない）"""
+        account = self.accounts.setdefault(username, {"requests": 0, "tweets": 0})
+        account["requests"] += 1
+        account["tweets"] += tweets
+
+    def can_spend(self):
+        self._roll_cycle()
+        return self.tweets < self.monthly_limit
+
+    def remaining(self):
+        return max(self.monthly_limit - self.tweets, 0)
+
+    def daily_rate(self):
+        """直近7日間の1日あたり取得ツイート数"""
+        now = datetime.utcnow()
+        recent = sum(
+            self.daily.get((now - timedelta(days=offset)).strftime("%Y-%m-%d"), 0)
+            for offset in range(7)
+        )
+        observed_days = (now - max(self.tracking_started, self.cycle_start)).total_seconds() / 86400
+        return recent / min(max(observed_days, 1.0), 7.0)
+
+    def forecast(self):
+        """現在のペースが続いた場合のサイクル末の使用量"""
+        self._roll_cycle()
+        remaining_days = max((self.cycle_end - datetime.utcnow()).total_seconds() / 86400, 0)
+        return self.tweets + self.daily_rate() * remaining_days
+
+    def pressure(self):
+        """予測使用量と上限（spend_ceiling）の比率。1.0 超は使いすぎ、1.0 未満は余裕あり"""
+        ceiling = self.monthly_limit * self.spend_ceiling
+        if ceiling <= 0:
+            return BUDGET_MAX_PRESSURE
+        return min(max(self.forecast() / ceiling, BUDGET_MIN_PRESSURE), BUDGET_MAX_PRESSURE)
+
+    async def sync_shared(self, store):
+        """自分の実績を共有ストアへ加算し、全ワーカー合計の実績で置き換える（アカウント別は自分の分のみ）"""
+        self._roll_cycle()
+        cycle = self.cycle_start.isoformat()
+        usage = await store.run(store.budget_usage, cycle)
+        if not usage and not self.unsynced:
+            # 共有ストアの初回利用時は単独で動いていた分を引き継ぐ
+            self.unsynced = {day: [0, tweets] for day, tweets in self.daily.items()}
+            if self.requests:
+                today = datetime.utcnow().strftime("%Y-%m-%d")
+                self.unsynced.setdefault(today, [0, 0])[0] += self.requests
+        if self.unsynced:
+            # 書き込み中に記録された分は次回の同期に回す
+            unsynced, self.unsynced = self.unsynced, {}
+            try:
+                await store.run(store.add_budget_usage, cycle, unsynced)
+            except BaseException:
+                for day, (requests, tweets) in unsynced.items():
+                    counts = self.unsynced.setdefault(day, [0, 0])
+                    counts[0] += requests
+                    counts[1] += tweets
+                raise
+            usage = await store.run(store.budget_usage, cycle)
+
+        self.requests = sum(requests for requests, _ in usage.values())
+        self.tweets = sum(tweets for _, tweets in usage.values())
+        self.daily = {day: tweets for day, (_, tweets) in usage.items()}
+
+    def to_state(self):
+        return {
+            "cycle_start": self.cycle_start.isoformat(),
+            "tracking_started": self.tracking_started.isoformat(),
+            "requests": self.requests,
+            "tweets": self.tweets,
+            "accounts": dict(self.accounts),
+            "daily": dict(self.daily),
+        }
+
+    def load_state(self, state):
+        # 別サイクルの記録は引き継がない
+        if not state or state.get("cycle_start") != self.cycle_start.isoformat():
+            return
+        self.tracking_started = datetime.fromisoformat(state["tracking_started"])
+        self.requests = state.get("requests", 0)
+        self.tweets = state.get("tweets", 0)
+        self.accounts = state.get("accounts", {})
+        self.daily = state.get("daily", {})
+
+
+def _add_months(value, months):
+    """value の months か月後（日は請求日のまま、1〜28日を想定）"""
+    month_index = value.month - 1 + months
+    return value.replace(year=value.year + month_index // 12, month=month_index % 12 + 1)
+
+# ツイートモデル（レスポンスを一度だけパースして保持）
+@dataclass(frozen=True, slots=True)
+class Media:
+    media_key: str
+    type: str
+    url: str | None = None
+    preview_image_url: str | None = None
+
+    @property
+    def image_url(self):
+        """埋め込みに使う画像URL（写真は本体、動画・GIFはプレビュー画像）"""
+        if self.type == "photo":
+            return self.url
+        if self.type in ("video", "animated_gif"):
+            return self.preview_image_url
+        return None
+
+
+@dataclass(frozen=True, slots=True)
+class Tweet:
+    id: str
+    text: str
+    created_at: str | None = None
+    author_id: str | None = None
+    media: tuple = ()
+
+    @property
+    def has_media(self):
+        """写真・動画・GIFのいずれかが添付されているか（media_only の絞り込み用）"""
+        return any(media.type in ("photo", "video", "animated_gif") for media in self.media)
+
+    @property
+    def created_at_datetime(self):
+        """created_at をUTCのdatetime（タイムゾーン無し）で返す"""
+        if not self.created_at:
+            return None
+        return datetime.fromisoformat(self.created_at.replace("Z", ""))
+
+    def to_dict(self):
+        """JSONで保存できる形に変換（キャッチアップ時の退避用）"""
+        return {
+            "id": self.id,
+            "text": self.text,
+            "created_at": self.created_at,
+            "author_id": self.author_id,
+            "media": [
+                {"media_key": m.media_key, "type": m.type, "url": m.url, "preview_image_url": m.preview_image_url}
+                for m in self.media
+            ],
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            id=data["id"],
+            text=data.get("text", ""),
+            created_at=data.get("created_at"),
+            author_id=data.get("author_id"),
+            media=tuple(Media(**media) for media in data.get("media", [])),
+        )
+
+
+def parse_tweets(data):
+    """APIレスポンスを Tweet のリストに変換（media_key の索引はレスポンスごとに1回だけ作成）"""
+    media_index = {
+        media["media_key"]: Media(
+            media_key=media["media_key"],
+            type=media.get("type", ""),
+            url=media.get("url"),
+            preview_image_url=media.get("preview_image_url"),
+        )
+        for media in data.get("includes", {}).get("media", [])
+    }
+
+    tweets = []
+    for tweet in data.get("data", []):
+        media_keys = tweet.get("attachments", {}).get("media_keys", [])
+        tweets.append(Tweet(
+            id=tweet["id"],
+            text=tweet.get("text", ""),
+            created_at=tweet.get("created_at"),
+            author_id=tweet.get("author_id"),
+            media=tuple(media_index[key] for key in media_keys if key in media_index),
+        ))
+    return tweets
+
+
+def build_tweet_embed(tweet):
+    """Tweet から Discord の埋め込みを作成"""
+    embed = discord.Embed(
+        description=tweet.text,
+        color=0x1DA1F2,
+        timestamp=datetime.utcnow()
+    )
+
+    for media in tweet.media:
+        if media.image_url:
+            embed.set_image(url=media.image_url)
+            break
+
+    return embed
+
+
+# Discord送信キュー（チャンネルごとに埋め込みをまとめて送信）
+class RecentIds:
+    """上限付きの最近のID集合（上限を超えたら古いものから捨てる）"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.ids = OrderedDict()
+
+    def __contains__(self, item_id):
+        return item_id in self.ids
+
+    def add(self, item_id):
+        self.ids[item_id] = None
+        self.ids.move_to_end(item_id)
+        while len(self.ids) > self.capacity:
+            self.ids.popitem(last=False)
+
+    def discard(self, item_id):
+        self.ids.pop(item_id, None)
+
+
+class DeliveryQueue:
+    """1チャンネル分の送信キュー（最大10件の埋め込みを1メッセージにまとめる）
+
+    送信間隔は discord.py のレート制限バケットに任せ、固定の待機は行わない。
+    送信済み・送信待ちのツイートIDを覚えておき、同じツイートは1回しか送らない。
+    """
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.queue = asyncio.Queue()
+        self.worker = None
+        self.recent_ids = RecentIds(DELIVERY_DEDUP_SIZE)
+        self._carry = None  # 文字数上限で次のメッセージに回した要素
+
+    async def put(self, embed, tweet_id=None):
+        """埋め込みをキューに追加し、送信完了を待てる Future を返す
+
+        送信済み（または送信待ち）のツイートIDなら送らずに False を返す Future を返す。
+        """
+        future = asyncio.get_running_loop().create_future()
+        if tweet_id is not None:
+            if tweet_id in self.recent_ids:
+                logger.info(f"Skipping duplicate tweet {tweet_id} for channel {self.channel.id}")
+                future.set_result(False)
+                return future
+            self.recent_ids.add(tweet_id)
+
+        await self.queue.put((embed, future, tweet_id))
+        if self.worker is None or self.worker.done():
+            self.worker = asyncio.create_task(self._run())
+        return future
+
+    async def _next_batch(self):
+        """キューから1メッセージ分の埋め込みを取り出す"""
+        loop = asyncio.get_running_loop()
+        if self._carry is not None:
+            first, self._carry = self._carry, None
+        else:
+            first = await self.queue.get()
+        batch = [first]
+        total_chars = len(first[0])
+        deadline = loop.time() + DELIVERY_LINGER
+
+        while len(batch) < DELIVERY_BATCH_SIZE:
+            try:
+                if self.queue.empty():
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                else:
+                    item = self.queue.get_nowait()
+            except asyncio.TimeoutError:
+                break
+            if total_chars + len(item[0]) > DELIVERY_MAX_EMBED_CHARS:
+                self._carry = item
+                break
+            batch.append(item)
+            total_chars += len(item[0])
+
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            await self._send(batch)
+
+    async def _send(self, batch):
+        """まとめて送信（一時的なエラーは指数バックオフで再試行）"""
+        embeds = [embed for embed, _, _ in batch]
+        error = None
+
+        for attempt in range(DELIVERY_MAX_RETRIES + 1):
+            try:
+                with POST_LATENCY.time():
+                    await self.channel.send(embeds=embeds)
+                logger.info(f"✅ Posted {len(embeds)} embed(s) to channel {self.channel.id}")
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_result(True)
+                return
+            except discord.Forbidden as e:
+                logger.error(f"❌ Permission denied: Cannot send messages to channel {self.channel.id}")
+                error = e
+                break
+            except discord.HTTPException as e:
+                # 5xx のみ再試行（429 は discord.py 側で待機・再送済み）
+                error = e
+                if e.status < 500:
+                    logger.error(f"Error posting to Discord: {e}")
+                    break
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = e
+
+            if attempt < DELIVERY_MAX_RETRIES:
+                backoff = 2 ** attempt
+                logger.warning(f"Transient error posting to Discord ({error}). Retrying in {backoff}s...")
+                await asyncio.sleep(backoff)
+
+        # 送信できなかったツイートは後で再送できるように送信済みから外す
+        for _, future, tweet_id in batch:
+            if tweet_id is not None:
+                self.recent_ids.discard(tweet_id)
+            if not future.done():
+                future.set_exception(error)
+
+
+delivery_queues = {}
+
+def get_delivery_queue(channel):
+    """チャンネルに対応する送信キューを取得（無ければ作成）"""
+    delivery_queue = delivery_queues.get(channel.id)
+    if delivery_queue is None:
+        delivery_queue = DeliveryQueue(channel)
+        delivery_queues[channel.id] = delivery_queue
+    return delivery_queue
+
+
+def is_transient_delivery_error(error):
+    """再送で解消しうる送信エラーか（5xx・通信エラー）
+
+    権限不足・削除済みの Webhook などの 4xx は何度送っても失敗するので恒久的なエラーとみなす。
+    """
+    if isinstance(error, discord.HTTPException):
+        return error.status >= 500
+    return True
+
+
+def create_http_session(headers=None):
+    """接続プール設定を共通化した HTTP セッションを作成（Twitter API・Webhook で共用）"""
+    connector = aiohttp.TCPConnector(
+        limit=HTTP_CONNECTION_LIMIT,
+        limit_per_host=HTTP_CONNECTION_LIMIT_PER_HOST,
+        ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+        keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+    )
+    timeout = aiohttp.ClientTimeout(
+        total=HTTP_TOTAL_TIMEOUT,
+        connect=HTTP_CONNECT_TIMEOUT,
+        sock_read=HTTP_READ_TIMEOUT,
+    )
+    return aiohttp.ClientSession(connector=connector, timeout=timeout, headers=headers)
+
+
+class WebhookChannel:
+    """Webhook の配信先（DeliveryQueue からはチャンネルと同じく id と send で扱う）"""
+
+    def __init__(self, channel_id, webhook):
+        self.id = channel_id
+        self.webhook = webhook
+
+    async def send(self, embeds):
+        await self.webhook.send(embeds=embeds)
+
+
+class WebhookDestinations:
+    """Webhook 配信用の共有HTTPセッションと配信先（DELIVERY_MODE=webhook）
+
+    Twitter API 用のセッションとは分ける（Authorization ヘッダーを Discord に送らないため）。
+    Webhook のレート制限は discord.py の Webhook 側で待機・再送される。
+    """
+
+    def __init__(self, urls):
+        self.urls = urls  # チャンネルID -> Webhook URL
+        self.channels = {}
+        self.session = None
+
+    async def start(self):
+        if self.session is not None and not self.session.closed:
+            return self.session
+
+        self.session = create_http_session()
+        self.channels = {}
+        logger.info(f"Webhook HTTP session started ({len(self.urls)} webhooks)")
+        return self.session
+
+    def get(self, channel_id):
+        """チャンネルIDに対応する配信先（Webhook が未設定なら None）"""
+        channel = self.channels.get(channel_id)
+        if channel is None and channel_id in self.urls and self.session is not None:
+            webhook = discord.Webhook.from_url(self.urls[channel_id], session=self.session)
+            channel = WebhookChannel(channel_id, webhook)
+            self.channels[channel_id] = channel
+        return channel
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+            logger.info("Webhook HTTP session closed")
+        self.session = None
+        self.channels = {}
+
+
+webhook_destinations = WebhookDestinations(CHANNEL_WEBHOOKS)
+
+
+class TwitterAPI:
+    def __init__(self, bearer_token):
+        if not bearer_token:
+            raise ValueError("Bearer token is required")
+        self.bearer_token = bearer_token
+        self.base_url = TWITTER_API_BASE_URL
+        self.session = None
+
+    async def start(self):
+        """共有HTTPセッションを作成（keep-alive + DNSキャッシュで接続を再利用）"""
+        if self.session is not None and not self.session.closed:
+            return self.session
+
+        self.session = create_http_session(headers={"Authorization": f"Bearer {self.bearer_token}"})
+        logger.info("Twitter API HTTP session started")
+        return self.session
+
+    async def close(self):
+        """共有HTTPセッションを閉じる"""
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+            logger.info("Twitter API HTTP session closed")
+        self.session = None
+
+    async def get_user_id(self, username):
+        """ユーザー名からユーザーIDを取得"""
+        ticket = await rate_limiter.wait_if_needed("user_lookup")
+        if ticket is None:
+            return None
+
+        url = f"{self.base_url}/users/by/username/{username}"
+
+        try:
+            session = await self.start()
+            started = time.perf_counter()
+            async with session.get(url) as response:
+                FETCH_LATENCY.observe(time.perf_counter() - started, endpoint="user_lookup")
+                rate_limiter.update_from_headers("user_lookup", response.headers, ticket)
+                record_api_result("user_lookup", response.status, response.headers)
+                if response.status == 200:
+                    budget_tracker.record("user_lookup", 0)
+                    data = await response.json()
+                    logger.info(f"Got user ID for {username}: {data['data']['id']}")
+                    return data["data"]["id"]
+                elif response.status == 429:
+                    logger.error("Rate limit exceeded from Twitter API")
+                    return None
+                elif response.status == 401:
+                    logger.error("Invalid Twitter Bearer Token")
+                    return None
+                elif response.status == 404:
+                    logger.error(f"User {username} not found")
+                    return None
+                else:
+                    logger.error(f"Failed to get user ID for {username}: HTTP {response.status}")
+                    response_text = await response.text()
+                    logger.error(f"Response: {response_text}")
+                    return None
+        except Exception as e:
+            record_api_result("user_lookup", None)
+            logger.error(f"Error getting user ID for {username}: {e}")
+            return None
+
+    async def get_user_ids(self, usernames):
+        """複数のユーザー名をまとめてユーザーIDに変換（/users/by、1リクエスト最大100件）
+
+        戻り値は ({username: user_id}, {username: エラー内容}) のタプル。
+        """
+        user_ids = {}
+        errors = {}
+        usernames = list(usernames)
+        url = f"{self.base_url}/users/by"
+
+        for i in range(0, len(usernames), USER_LOOKUP_BATCH_SIZE):
+            batch = usernames[i:i + USER_LOOKUP_BATCH_SIZE]
+            # APIはユーザー名の大文字小文字を区別しないため、元の表記に戻せるようにする
+            by_lower = {name.lower(): name for name in batch}
+
+            ticket = await rate_limiter.wait_if_needed("user_lookup")
+            if ticket is None:
+                for name in batch:
+                    errors[name] = "Skipped (monthly limit reached or user lookup circuit open)"
+                continue
+
+            try:
+                session = await self.start()
+                started = time.perf_counter()
+                async with session.get(url, params={"usernames": ",".join(batch)}) as response:
+                    FETCH_LATENCY.observe(time.perf_counter() - started, endpoint="user_lookup")
+                    rate_limiter.update_from_headers("user_lookup", response.headers, ticket)
+                    record_api_result("user_lookup", response.status, response.headers)
+                    if response.status == 200:
+                        budget_tracker.record("user_lookup", 0)
+                        data = await response.json()
+                        for user in data.get("data", []):
+                            name = by_lower.get(user["username"].lower(), user["username"])
+                            user_ids[name] = user["id"]
+                        for error in data.get("errors", []):
+                            name = by_lower.get(str(error.get("value", "")).lower())
+                            if name:
+                                errors[name] = error.get("detail") or error.get("title", "Unknown error")
+                        logger.info(f"Resolved {len(batch)} usernames in one request ({len(data.get('data', []))} found)")
+                    elif response.status == 429:
+                        logger.error("Rate limit exceeded from Twitter API")
+                        for name in batch:
+                            errors[name] = "Rate limit exceeded"
+                    elif response.status == 401:
+                        logger.error("Invalid Twitter Bearer Token")
+                        for name in batch:
+                            errors[name] = "Invalid Twitter Bearer Token"
+                    else:
+                        response_text = await response.text()
+                        logger.error(f"Failed to resolve usernames: HTTP {response.status}")
+                        logger.error(f"Response: {response_text}")
+                        for name in batch:
+                            errors[name] = f"HTTP {response.status}"
+            except Exception as e:
+                record_api_result("user_lookup", None)
+                logger.error(f"Error resolving usernames {batch}: {e}")
+                for name in batch:
+                    errors[name] = str(e)
+
+        # レスポンスに含まれなかったユーザー名もエラーとして扱う
+        for name in usernames:
+            if name not in user_ids and name not in errors:
+                errors[name] = "Not returned by API"
+
+        return user_ids, errors
+
+    async def get_user_tweets(self, user_id, username, max_results=5, since_id=None, start_time=None):
+        """ユーザーの最新ツイートを取得（画像・メディア対応 + スキップ対応）
+
+        since_id を指定するとそれより新しいツイートのみ、since_id が無い場合は
+        start_time 以降のツイートのみを取得する。失敗時は None を返す。
+        """
+        page = await self.get_user_tweets_page(user_id, username, max_results, since_id, start_time)
+        return None if page is None else page[0]
+
+    async def get_user_tweets_page(self, user_id, username, max_results=5, since_id=None, start_time=None,
+                                   pagination_token=None):
+        """get_user_tweets のページ単位版
+
+        戻り値は (ツイートのリスト, 次ページのトークン)。失敗時・遮断中は None を返す。
+        """
+        # アカウントの試行枠はエンドポイントの待機より先に取る（送信枠とエンドポイントの試行枠を無駄にしないように）
+        # 待機の結果送信しなかった場合は枠を返す
+        account_breaker = account_breakers.get(username)
+        if not account_breaker.allow():
+            logger.info(f"Circuit for {username} is {account_breaker.state}, skipping fetch")
+            return None
+        try:
+            ticket = await rate_limiter.wait_if_needed("user_tweets")
+        except BaseException:
+            account_breaker.release_probe()
+            raise
+        if ticket is None:
+            account_breaker.release_probe()
+            return None
+
+        url = f"{self.base_url}/users/{user_id}/tweets"
+        max_results = max(5, min(max_results, 100))
+
+        params = {
+            "max_results": max_results,
+            "tweet.fields": "created_at,attachments",
+            "media.fields": "url,preview_image_url,type",
+            "expansions": "attachments.media_keys",
+            "exclude": "retweets,replies"
+        }
+        if since_id:
+            params["since_id"] = since_id
+        elif start_time:
+            params["start_time"] = start_time.strftime("%Y-%m-%dT%H:%M:%SZ")
+        if pagination_token:
+            params["pagination_token"] = pagination_token
+
+        try:
+            session = await self.start()
+            started = time.perf_counter()
+            async with session.get(url, params=params) as response:
+                FETCH_LATENCY.observe(time.perf_counter() - started, endpoint="user_tweets")
+                rate_limiter.update_from_headers("user_tweets", response.headers, ticket)
+                record_api_result("user_tweets", response.status, response.headers, username)
+
+                # レート制限の詳細情報をログ出力
+                logger.info(
+                    "Rate limit info - Remaining: %s, Limit: %s, Reset: %s",
+                    response.headers.get('x-rate-limit-remaining', 'Unknown'),
+                    response.headers.get('x-rate-limit-limit', 'Unknown'),
+                    response.headers.get('x-rate-limit-reset', 'Unknown'),
+                    extra=sampled("rate_limit_info"),
+                )
+                
+                if response.status == 200:
+                    data = await response.json()
+                    tweets = parse_tweets(data)
+                    meta = data.get("meta", {})
+                    budget_tracker.record("user_tweets", meta.get("result_count", len(tweets)), username)
+
+                    logger.info("Retrieved %d tweets for user %s", len(tweets), user_id, extra=sampled("retrieved"))
+                    return tweets, meta.get("next_token")
+
+                elif response.status == 429:
+                    logger.error("Rate limit exceeded from Twitter API")
+                    response_text = await response.text()
+                    logger.error(f"Rate limit response: {response_text}")
+                    return None
+
+                elif response.status == 401:
+                    logger.error("Invalid Twitter Bearer Token")
+                    response_text = await response.text()
+                    logger.error(f"Auth error response: {response_text}")
+                    return None
+
+                else:
+                    logger.error(f"Failed to get tweets for user {user_id}: HTTP {response.status}")
+                    response_text = await response.text()
+                    logger.error(f"Response: {response_text}")
+                    return None
+
+        except Exception as e:
+            record_api_result("user_tweets", None, username=username)
+            logger.error(f"Error getting tweets for user {user_id}: {e}")
+            return None
+
+    async def search_recent_tweets(self, query, since_id=None, max_results=100, next_token=None, start_time=None):
+        """recent search でツイートを取得（複数アカウントをまとめた from: クエリ用）
+
+        since_id が無ければ start_time 以降を取得する。戻り値は (ツイートのリスト, 次ページのトークン)。失敗時は None を返す。
+        """
+        ticket = await rate_limiter.wait_if_needed("search_recent")
+        if ticket is None:
+            return None
+
+        url = f"{self.base_url}/tweets/search/recent"
+        params = {
+            "query": query,
+            "max_results": max(10, min(max_results, 100)),
+            "tweet.fields": "created_at,attachments,author_id",
+            "media.fields": "url,preview_image_url,type",
+            "expansions": "attachments.media_keys",
+        }
+        if since_id:
+            params["since_id"] = since_id
+        elif start_time:
+            params["start_time"] = start_time.strftime("%Y-%m-%dT%H:%M:%SZ")
+        if next_token:
+            params["next_token"] = next_token
+
+        try:
+            session = await self.start()
+            started = time.perf_counter()
+            async with session.get(url, params=params) as response:
+                FETCH_LATENCY.observe(time.perf_counter() - started, endpoint="search_recent")
+                rate_limiter.update_from_headers("search_recent", response.headers, ticket)
+                record_api_result("search_recent", response.status, response.headers)
+
+                if response.status == 200:
+                    data = await response.json()
+                    tweets = parse_tweets(data)
+                    meta = data.get("meta", {})
+                    budget_tracker.record("search_recent", meta.get("result_count", len(tweets)))
+                    logger.info("Retrieved %d tweets from recent search", len(tweets), extra=sampled("retrieved"))
+                    return tweets, meta.get("next_token")
+
+                elif response.status == 429:
+                    logger.error("Rate limit exceeded from Twitter API (recent search)")
+                    return None
+
+                elif response.status == 401:
+                    logger.error("Invalid Twitter Bearer Token")
+                    return None
+
+                else:
+                    logger.error(f"Failed to search tweets: HTTP {response.status}")
+                    response_text = await response.text()
+                    logger.error(f"Response: {response_text}")
+                    return None
+
+        except Exception as e:
+            record_api_result("search_recent", None)
+            logger.error(f"Error searching tweets: {e}")
+            return None
+
+    async def get_stream_rules(self):
+        """フィルタードストリームの登録済みルール [{"id", "value", "tag"}]（失敗時は None）"""
+        try:
+            session = await self.start()
+            async with session.get(f"{self.base_url}/tweets/search/stream/rules") as response:
+                if response.status == 200:
+                    data = await response.json()
+                    return data.get("data", [])
+                logger.error(f"Failed to get stream rules: HTTP {response.status}")
+                logger.error(f"Response: {await response.text()}")
+                return None
+        except Exception as e:
+            logger.error(f"Error getting stream rules: {e}")
+            return None
+
+    async def update_stream_rules(self, add=(), delete_ids=()):
+        """ルールの追加（値のリスト）・削除（IDのリスト）を行い、成功したら True"""
+        try:
+            session = await self.start()
+            url = f"{self.base_url}/tweets/search/stream/rules"
+            if delete_ids:
+                async with session.post(url, json={"delete": {"ids": list(delete_ids)}}) as response:
+                    if response.status != 200:
+                        logger.error(f"Failed to delete stream rules: HTTP {response.status}")
+                        logger.error(f"Response: {await response.text()}")
+                        return False
+            if add:
+                body = {"add": [{"value": value, "tag": STREAM_RULE_TAG} for value in add]}
+                async with session.post(url, json=body) as response:
+                    if response.status not in (200, 201):
+                        logger.error(f"Failed to add stream rules: HTTP {response.status}")
+                        logger.error(f"Response: {await response.text()}")
+                        return False
+            return True
+        except Exception as e:
+            logger.error(f"Error updating stream rules: {e}")
+            return False
+
+    async def stream_tweets(self, on_connect=None, on_data=None):
+        """フィルタードストリームに接続し、届いたツイートを順に返す非同期ジェネレータ
+
+        1行1件のJSONを受け取るたびに処理し、レスポンス全体は保持しない。空行は keep-alive。
+        on_connect は接続成功時、on_data は1行（keep-alive を含む）受け取るたびに呼ばれる。
+        STREAM_HEARTBEAT_TIMEOUT 秒何も届かなければ asyncio.TimeoutError で終了する。
+        接続に失敗した場合は StreamError を送出する。
+        """
+        ticket = await rate_limiter.wait_if_needed("search_stream")
+        if ticket is None:
+            raise StreamError("search_stream is not available (monthly limit or circuit open)")
+
+        params = {
+            "tweet.fields": "created_at,attachments,author_id",
+            "media.fields": "url,preview_image_url,type",
+            "expansions": "attachments.media_keys",
+        }
+        # 共有セッションの全体タイムアウトは使わず、無通信時間だけで切断を検知する
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=HTTP_CONNECT_TIMEOUT, sock_read=STREAM_HEARTBEAT_TIMEOUT)
+        session = await self.start()
+        async with session.get(f"{self.base_url}/tweets/search/stream", params=params, timeout=timeout) as response:
+            rate_limiter.update_from_headers("search_stream", response.headers, ticket)
+            record_api_result("search_stream", response.status, response.headers)
+            if response.status != 200:
+                reset = response.headers.get("x-rate-limit-reset")
+                raise StreamError(
+                    f"HTTP {response.status}: {await response.text()}",
+                    retry_at=float(reset) if response.status == 429 and reset else None,
+                )
+
+            budget_tracker.record("search_stream", 0)
+            if on_connect is not None:
+                on_connect()
+            async for line in response.content:
+                if on_data is not None:
+                    on_data()
+                line = line.strip()
+                if not line:
+                    continue  # keep-alive
+                data = json.loads(line)
+                if "data" not in data:
+                    # 切断予告などの操作メッセージ
+                    logger.warning(f"Stream message: {data.get('errors') or data}")
+                    continue
+                for tweet in parse_tweets({"data": [data["data"]], "includes": data.get("includes", {})}):
+                    yield tweet
+
+
+class StreamError(Exception):
+    """ストリームに接続できなかった（retry_at は 429 の場合のリセット時刻）"""
+
+    def __init__(self, message, retry_at=None):
+        super().__init__(message)
+        self.retry_at = retry_at
+
+
+def build_search_queries(usernames, max_length):
+    """ユーザー名を from:a OR from:b ... のクエリに詰める（クエリ長の上限を守る）
+
+    戻り値は [(クエリ, そのクエリに含まれるユーザー名のリスト)]。
+    """
+    suffix = " -is:retweet -is:reply"
+    base_length = len("()") + len(suffix)
+    queries = []
+    batch = []
+    length = base_length
+
+    for username in usernames:
+        term = f"from:{username}"
+        added = len(term) + (len(" OR ") if batch else 0)
+        if batch and length + added > max_length:
+            queries.append(("(" + " OR ".join(f"from:{name}" for name in batch) + ")" + suffix, batch))
+            batch = []
+            length = base_length
+            added = len(term)
+        batch.append(username)
+        length += added
+
+    if batch:
+        queries.append(("(" + " OR ".join(f"from:{name}" for name in batch) + ")" + suffix, batch))
+    return queries
+
+# 初期化時のエラーハンドリング強化
+def validate_environment():
+    """環境変数の検証"""
+    errors = []
+    
+    if DELIVERY_MODE == "webhook":
+        destinations = {channel_id for username in TARGET_ACCOUNTS
+                        for channel_id in ACCOUNT_ROUTES.get(username) or [CHANNEL_ID]}
+        missing = sorted(str(channel_id) for channel_id in destinations if channel_id and channel_id not in CHANNEL_WEBHOOKS)
+        if missing:
+            errors.append(f"No webhook URL configured for channels: {', '.join(missing)} (set WEBHOOK_URL or CHANNEL_WEBHOOKS)")
+        for channel_id, url in CHANNEL_WEBHOOKS.items():
+            try:
+                # URLの形式だけを確認（セッションを渡さないので通信はしない）
+                discord.Webhook.from_url(url, session=None)
+            except ValueError:
+                errors.append(f"Invalid webhook URL for channel {channel_id}")
+    elif not DISCORD_TOKEN:
+        errors.append("DISCORD_TOKEN is not set")
+    
+    if not CHANNEL_ID and any(username not in ACCOUNT_ROUTES for username in TARGET_ACCOUNTS):
+        errors.append("CHANNEL_ID is not set or invalid (required for accounts without ACCOUNT_ROUTES)")
+    
+    if not TWITTER_BEARER_TOKEN:
+        errors.append("TWITTER_BEARER_TOKEN is not set")
+    
+    try:
+        TweetFilter(ACCOUNT_FILTERS, CHANNEL_FILTERS)
+    except ValueError as e:
+        errors.append(f"Invalid tweet filter: {e}")
+    
+    if errors:
+        for error in errors:
+            logger.error(error)
+        return False
+    
+    return True
+
+# 環境変数検証後にTwitterAPI初期化
+if validate_environment():
+    budget_tracker = BudgetTracker(MONTHLY_TWEET_LIMIT, BILLING_CYCLE_DAY, BUDGET_SPEND_CEILING)
+    rate_limiter = RateLimiter()
+    twitter_api = TwitterAPI(TWITTER_BEARER_TOKEN)
+    state_store = StateStore(STATE_DB_PATH)
+    tweet_filter = TweetFilter(ACCOUNT_FILTERS, CHANNEL_FILTERS)
+    account_breakers = CircuitBreakers("account", BREAKER_FAILURE_THRESHOLD, BREAKER_BASE_DELAY, ACCOUNT_BREAKER_MAX_DELAY)
+    endpoint_breakers = CircuitBreakers("endpoint", BREAKER_FAILURE_THRESHOLD, BREAKER_BASE_DELAY, ENDPOINT_BREAKER_MAX_DELAY)
+else:
+    logger.error("Environment validation failed. Exiting...")
+    exit(1)
+
+def load_state():
+    """保存済みの状態を読み込み（再起動時にAPIを呼ばずに復元）"""
+    restored = restore_accounts(TARGET_ACCOUNTS)
+    rate_limiter.load_state(state_store.get_json("rate_limiter"))
+    endpoint_breakers.load_state(state_store.get_json("endpoint_breakers"))
+    budget_tracker.load_state(state_store.get_json("budget"))
+    logger.info(f"Restored state for {restored}/{len(TARGET_ACCOUNTS)} accounts from {STATE_DB_PATH}")
+
+def restore_accounts(usernames, saved_accounts=None):
+    """指定アカウントの状態をストアから読み込む（戻り値は復元できたアカウント数）
+
+    saved_accounts を渡すとストアを読まずにその内容から復元する。
+    """
+    if saved_accounts is None:
+        saved_accounts = state_store.load_accounts()
+    restored = 0
+
+    for username in usernames:
+        account = saved_accounts.get(username)
+        if not account:
+            continue
+        restored += 1
+        if account["user_id"]:
+            TARGET_ACCOUNTS[username] = account["user_id"]
+        last_tweet_ids[username] = account["last_tweet_id"]
+        if account["last_checked_at"]:
+            last_checked_at[username] = account["last_checked_at"]
+        if account["search_since_id"]:
+            search_since_ids[username] = account["search_since_id"]
+        if account["skip_until"]:
+            skip_until[username] = account["skip_until"]
+            # 遮断中だったアカウントは残り時間だけ open として復元
+            opened_until = account["skip_until"].replace(tzinfo=timezone.utc).timestamp()
+            if opened_until > time.time():
+                account_breakers.get(username).load_state({"state": "open", "opened_until": opened_until})
+    return restored
+
+# 次回の flush_state で保存するアカウント
+dirty_accounts = set()
+
+def save_state(username=None):
+    """アカウント状態を保存対象に加える（書き込みは flush_state でまとめて行う）"""
+    if username is not None:
+        dirty_accounts.add(username)
+
+async def flush_state():
+    """保存対象のアカウント状態とレート制限カウンタを1トランザクションで保存
+
+    値はイベントループ上で写し取り、SQLiteへの書き込みは書き込み用スレッドで行う。
+    """
+    accounts = [
+        (username, TARGET_ACCOUNTS.get(username), last_tweet_ids.get(username),
+         last_checked_at.get(username), skip_until.get(username), search_since_ids.get(username))
+        for username in dirty_accounts
+    ]
+    dirty_accounts.clear()
+    values = {
+        "rate_limiter": rate_limiter.to_state(),
+        "endpoint_breakers": endpoint_breakers.to_state(),
+        "budget": budget_tracker.to_state(),
+    }
+    try:
+        await state_store.run(state_store.save, accounts, values)
+    except Exception as e:
+        # 次回の保存でやり直す
+        dirty_accounts.update(account[0] for account in accounts)
+        logger.error(f"Error saving state: {e}")
+
+load_state()
+
+async def initialize_user_ids():
+    """起動時にユーザーIDを取得"""
+    logger.info(f"Initializing user IDs for accounts: {list(TARGET_ACCOUNTS.keys())}")
+
+    pending = [username for username, user_id in TARGET_ACCOUNTS.items() if user_id is None]
+    if not pending:
+        logger.info("All user IDs already initialized")
+        return
+
+    # 未取得のアカウントを一括で変換（最大100件/リクエスト）
+    try:
+        user_ids, errors = await twitter_api.get_user_ids(pending)
+    except Exception as e:
+        logger.error(f"Error initializing user IDs: {e}")
+        return
+
+    for username, user_id in user_ids.items():
+        TARGET_ACCOUNTS[username] = user_id
+        save_state(username)
+        logger.info(f"✅ Initialized user ID for {username}: {user_id}")
+    await flush_state()
+
+    for username, error in errors.items():
+        logger.error(f"❌ Failed to get user ID for {username}: {error}")
+
+async def wait_until_ready():
+    """配信できる状態になるまで待つ（webhook モードはゲートウェイに接続しないので待たない）"""
+    if DELIVERY_MODE != "webhook":
+        await bot.wait_until_ready()
+
+
+async def check_and_post_updates(usernames=None, job=None):
+    """新規ツイートをチェックしてDiscordに送信（複数投稿対応 + スキップ管理）
+
+    usernames を指定するとそのアカウントのみチェックする。job を渡すと進捗を記録する。
+    戻り値は {username: 新規ツイート数（失敗時は None）}。
+    """
+    await wait_until_ready()
+    logger.info("Checking for new tweets (rate-limited)...")
+    
+    # 初回のユーザーID取得（同時に複数のチェックが走っても1回だけ実行）
+    async with user_id_init_lock:
+        if None in TARGET_ACCOUNTS.values():
+            logger.info("Some accounts not initialized, initializing now...")
+            await initialize_user_ids()
+    
+    active_accounts = {
+        k: v for k, v in TARGET_ACCOUNTS.items()
+        if v is not None and account_breakers.get(k).available()
+        and (usernames is None or k in usernames)
+        and shard_coordinator.owns(k)
+    }
+    logger.info(f"Active accounts: {len(active_accounts)}/{len(TARGET_ACCOUNTS)}")
+    if job is not None:
+        job.total = len(active_accounts)
+
+    # 実行中のチェックに含まれるアカウントは新たに取得せず、その結果を待つ
+    joined = {username: in_flight_checks[username] for username in active_accounts if username in in_flight_checks}
+    to_check = {username: user_id for username, user_id in active_accounts.items() if username not in joined}
+    if joined:
+        logger.info(f"Joining in-flight checks for {len(joined)} accounts")
+
+    loop = asyncio.get_running_loop()
+    own = {username: loop.create_future() for username in to_check}
+    in_flight_checks.update(own)
+    results = {}
+    try:
+        if to_check:
+            results = await run_account_checks(to_check, job)
+    finally:
+        for username, future in own.items():
+            if not future.done():
+                future.set_result(results.get(username))
+            if in_flight_checks.get(username) is future:
+                del in_flight_checks[username]
+        refresh_status_snapshot()
+        # このサイクルで更新したアカウントの状態をまとめて保存
+        await flush_state()
+
+    for username, future in joined.items():
+        results[username] = await future
+        if job is not None:
+            job.record(results[username])
+    return results
+
+
+async def run_account_checks(accounts, job=None):
+    """アカウントごとに並行して取得・投稿（同時取得数は POLL_CONCURRENCY で制限）"""
+    if FETCH_MODE == "search":
+        return await check_accounts_by_search(list(accounts), poll_semaphore, job)
+
+    async def run(username, user_id):
+        result = await check_account(username, user_id, poll_semaphore)
+        if job is not None:
+            job.record(result)
+        return result
+
+    results = await asyncio.gather(*(run(username, user_id) for username, user_id in accounts.items()))
+    return dict(zip(accounts, results))
+
+
+# 実行中のチェック（username -> 結果の Future）。重複チェックを1回にまとめる
+in_flight_checks = {}
+user_id_init_lock = asyncio.Lock()
+poll_semaphore = asyncio.Semaphore(POLL_CONCURRENCY)
+
+
+def destination_channel_ids(username):
+    """アカウントの配信先チャンネルID一覧"""
+    return ACCOUNT_ROUTES.get(username) or ([CHANNEL_ID] if CHANNEL_ID else [])
+
+
+def all_destination_channel_ids():
+    """全アカウントの配信先チャンネルID（重複なし）"""
+    channel_ids = []
+    for username in TARGET_ACCOUNTS:
+        for channel_id in destination_channel_ids(username):
+            if channel_id not in channel_ids:
+                channel_ids.append(channel_id)
+    return channel_ids
+
+
+def resolve_destinations(username):
+    """送信可能な配信先チャンネルを取得（見つからない・権限が無いチャンネルは除外）"""
+    channels = []
+    for channel_id in destination_channel_ids(username):
+        if DELIVERY_MODE == "webhook":
+            channel = webhook_destinations.get(channel_id)
+            if channel is None:
+                logger.error(f"No webhook configured for channel {channel_id}")
+            else:
+                channels.append(channel)
+            continue
+
+        channel = bot.get_channel(channel_id)
+        if not channel:
+            logger.error(f"Discord channel not found (ID: {channel_id})")
+            continue
+
+        bot_member = channel.guild.me
+        if bot_member and not channel.permissions_for(bot_member).send_messages:
+            logger.error(f"❌ Bot doesn't have permission to send messages in channel {channel_id}")
+            continue
+
+        channels.append(channel)
+    return channels
+
+
+async def check_account(username, user_id, semaphore):
+    """1アカウント分の新規ツイートを取得して全配信先に投稿（投稿順はアカウント内で維持）
+
+    戻り値は新規ツイート数（取得に失敗した場合は None）。
+    """
+    new_count = None
+    try:
+        channels = resolve_destinations(username)
+        if not channels:
+            logger.error(f"No available destination channels for {username}, skipping")
+            return None
+
+        logger.info("Checking %s (ID: %s)...", username, user_id, extra=sampled("checking"))
+        since_id = last_tweet_ids[username]
+        start_time = last_checked_at.get(username) if since_id is None else None
+        incremental = since_id is not None or start_time is not None
+        fetch_started = datetime.utcnow()
+
+        # since_id / start_time があれば新規分のみ取得、初回は最新1件だけ投稿する
+        async with semaphore:
+            page = await twitter_api.get_user_tweets_page(
+                user_id, username,
+                max_results=20 if incremental else 5,
+                since_id=since_id,
+                start_time=start_time,
+            )
+
+        # 1ページに収まらない場合は停止中の取りこぼしがあるので、前回の位置まで遡って回収する
+        if page is not None and page[1] and incremental:
+            new_count = await catch_up_account(
+                username, user_id, channels, page, since_id, start_time, fetch_started, semaphore
+            )
+        else:
+            tweets = None if page is None else page[0]
+            new_count = await handle_fetched_tweets(username, channels, tweets, incremental, fetch_started)
+            
+    except Exception as e:
+        logger.error(f"Error checking {username}: {e}")
+    finally:
+        save_state(username)
+
+    return new_count
+
+
+async def handle_fetched_tweets(username, channels, tweets, incremental, fetch_started):
+    """取得結果を状態に反映して新規ツイートを投稿（戻り値は新規ツイート数、取得失敗時は None）
+
+    tweets は新しい順。incremental でない（初回取得）場合は最新1件だけ投稿する。
+    """
+    if tweets is None:
+        return None
+
+    if not tweets:
+        last_checked_at[username] = fetch_started
+        logger.info("No new tweets for %s", username, extra=sampled("no_new_tweets"))
+        return 0
+
+    new_tweets = tweets if incremental else [tweets[0]]
+    delivered_id = await deliver_tweets(username, channels, list(reversed(new_tweets)))
+    advance_cursor(username, delivered_id, new_tweets[0].id, fetch_started)
+
+    # 初回取得分は過去のツイートなので投稿頻度の計算には含めない
+    return len(tweets) if incremental else 0
+
+
+def advance_cursor(username, delivered_id, newest_id, checked_at=None):
+    """配信できた位置までアカウントの位置を進める（後戻りはしない）
+
+    送信に失敗したツイートより先には進めず（次回そこから取り直す）、delivery_backlog に加える。
+    checked_at を渡すと、全件配信できたときだけ最終チェック時刻も進める（since_id が無い場合に失敗分を飛ばさないように）。
+    """
+    last_id = last_tweet_ids.get(username)
+    if delivered_id is not None and (not last_id or int(delivered_id) > int(last_id)):
+        last_tweet_ids[username] = delivered_id
+    if delivered_id != newest_id:
+        delivery_backlog.add(username)
+        return
+    delivery_backlog.discard(username)
+    if checked_at is not None:
+        last_checked_at[username] = checked_at
+
+
+async def deliver_tweets(username, channels, tweets):
+    """古い順に並んだツイートを全配信先に投稿し、送信完了まで待つ
+
+    戻り値は先頭から途切れずに配信できた（絞り込み・重複で送らなかった分を含む）最後のツイートのID。
+    先頭のツイートから失敗した場合は None。
+    権限不足などの恒久的なエラーで送れなかった配信先は取り直しても届かないので、破棄として数えて先に進む。
+    """
+    deliveries, filtered = await enqueue_tweets(username, channels, tweets)
+    results = await report_deliveries(username, channels, len(tweets) - filtered, deliveries)
+    failed_ids = set()
+    for (tweet, channel_id, _), result in zip(deliveries, results):
+        if not isinstance(result, Exception):
+            continue
+        if is_transient_delivery_error(result):
+            failed_ids.add(tweet.id)
+        else:
+            DROPPED_DELIVERIES.inc(account=username, channel=channel_id)
+            logger.error(f"Dropping tweet {tweet.id} for {username} in channel {channel_id}: {result}")
+    delivered_id = None
+    for tweet in tweets:
+        if tweet.id in failed_ids:
+            break
+        delivered_id = tweet.id
+    return delivered_id
+
+
+async def enqueue_tweets(username, channels, tweets):
+    """ツイートを配信キューに積む（戻り値は ([(ツイート, チャンネルID, 送信完了を待つ Future)], 絞り込みで落とした件数)）"""
+    # 埋め込みは1回だけ作成し、絞り込みルールを通った配信先のキューへ古い順に積む
+    # （キューはFIFOなのでチャンネルごとの投稿順が保たれ、送信はチャンネル間で並行する）
+    delivery_queues_for_account = {channel.id: get_delivery_queue(channel) for channel in channels}
+    deliveries = []
+    filtered = 0
+    for tweet in tweets:
+        logger.info("🆕 New tweet found for %s: %s", username, tweet.id, extra=sampled("new_tweet"))
+        accepted = tweet_filter.accepted_channels(username, tweet, delivery_queues_for_account)
+        if not accepted:
+            # どの配信先にも送らないツイートは埋め込みを作らずに捨てる
+            filtered += 1
+            continue
+        embed = build_tweet_embed(tweet)
+        for channel_id in accepted:
+            deliveries.append((tweet, channel_id, await delivery_queues_for_account[channel_id].put(embed, tweet.id)))
+
+    if filtered:
+        FILTERED_TWEETS.inc(filtered, account=username)
+        logger.info(f"Filtered out {filtered}/{len(tweets)} tweets for {username}")
+    return deliveries, filtered
+
+
+async def report_deliveries(username, channels, posted, deliveries):
+    """送信完了を待って結果をログに残す（戻り値は deliveries と同じ順の送信結果）"""
+    results = await asyncio.gather(*(future for _, _, future in deliveries), return_exceptions=True)
+    failed = sum(1 for result in results if isinstance(result, Exception))
+    duplicates = sum(1 for result in results if result is False)
+    if duplicates:
+        logger.info(f"Skipped {duplicates} already delivered updates for {username}")
+    if failed:
+        logger.error(f"Failed to post {failed}/{len(results)} updates for {username}")
+    else:
+        logger.info(f"✅ Posted {posted} updates for {username} to {len(channels)} channel(s)")
+    return results
+
+
+async def catch_up_account(username, user_id, channels, first_page, since_id, start_time, fetch_started, semaphore):
+    """前回の位置までページを遡って取得し、古い順に投稿（戻り値は取得したツイート数、失敗時は None）
+
+    ページは取得したそばからSQLiteに退避するので、メモリに載るのは1ページ分だけ。
+    取得件数は残り月間予算の CATCHUP_BUDGET_SHARE 倍までに制限し、超えた分（古い側）は諦める。
+    """
+    tweets, next_token = first_page
+    cap = max(int(budget_tracker.remaining() * CATCHUP_BUDGET_SHARE), len(tweets))
+    fetched = 0
+    logger.info(f"Catching up {username} (up to {cap} tweets)")
+
+    await state_store.run(state_store.clear_spilled_tweets, username)
+    try:
+        while True:
+            await state_store.run(state_store.spill_tweets, username, [(int(tweet.id), tweet.to_dict()) for tweet in tweets])
+            fetched += len(tweets)
+            if not next_token:
+                break
+            if fetched >= cap:
+                logger.warning(f"Catch-up for {username} stopped at the budget cap ({fetched} tweets); older tweets are skipped")
+                break
+
+            async with semaphore:
+                page = await twitter_api.get_user_tweets_page(
+                    user_id, username,
+                    max_results=min(CATCHUP_PAGE_SIZE, cap - fetched),
+                    since_id=since_id,
+                    start_time=start_time,
+                    pagination_token=next_token,
+                )
+            if page is None:
+                # 途中で失敗したら位置を進めずに次回やり直す（新しい側だけ投稿すると順序が崩れるため）
+                logger.error(f"Catch-up for {username} failed after {fetched} tweets, will retry on next check")
+                return None
+            tweets, next_token = page
+
+        # 古い順に少しずつ読み出して投稿し、投稿済みの位置を都度保存する（途中で停止しても続きから再開できる）
+        after_id = -1
+        while True:
+            rows = await state_store.run(state_store.load_spilled_tweets, username, after_id, CATCHUP_POST_BATCH)
+            if not rows:
+                break
+            after_id = rows[-1][0]
+            batch = [Tweet.from_dict(row) for _, row in rows]
+            delivered_id = await deliver_tweets(username, channels, batch)
+            # 配信できた位置までだけ進める（失敗分より後を投稿すると順序が崩れるので、ここで打ち切って次回再開する）
+            advance_cursor(username, delivered_id, batch[-1].id)
+            if delivered_id is not None:
+                save_state(username)
+                await flush_state()
+            if delivered_id != batch[-1].id:
+                logger.error(f"Catch-up for {username} stopped at a failed delivery, will resume from {last_tweet_ids[username]}")
+                return None
+    finally:
+        await state_store.run(state_store.clear_spilled_tweets, username)
+
+    last_checked_at[username] = fetch_started
+    logger.info(f"Caught up {username}: {fetched} tweets")
+    return fetched
+
+
+async def check_accounts_by_search(usernames, semaphore, job=None):
+    """recent search で複数アカウントをまとめてチェック（戻り値は check_and_post_updates と同じ）"""
+    results = {username: None for username in usernames}
+    channels_by_username = {}
+    for username in usernames:
+        channels = resolve_destinations(username)
+        if channels:
+            channels_by_username[username] = channels
+        else:
+            logger.error(f"No available destination channels for {username}, skipping")
+            if job is not None:
+                job.record(None)
+
+    async def run(query, batch):
+        batch_result = await check_search_batch(query, batch, channels_by_username, semaphore)
+        if job is not None:
+            for username in batch:
+                job.record(batch_result.get(username))
+        return batch_result
+
+    queries = build_search_queries(list(channels_by_username), SEARCH_QUERY_MAX_LENGTH)
+    logger.info(f"Checking {len(channels_by_username)} accounts with {len(queries)} search queries")
+    batch_results = await asyncio.gather(*(run(query, batch) for query, batch in queries))
+    for batch_result in batch_results:
+        results.update(batch_result)
+    return results
+
+
+def search_lower_bound(usernames):
+    """クエリの取得開始位置 (since_id, start_time) を決める（どちらも None なら最新1ページのみ）
+
+    全アカウントに既知のIDがあれば最も古いものを since_id にし、無いアカウントがあれば
+    最後にチェックした時刻を start_time にする。どちらも recent search の範囲（約7日）に収める。
+    """
+    window_start = time.time() - SEARCH_WINDOW
+    cursors = []
+    bounds = []  # アカウントごとの取得開始時刻（epoch秒）
+    for username in usernames:
+        known_ids = [int(value) for value in (search_since_ids.get(username), last_tweet_ids.get(username)) if value]
+        checked_at = last_checked_at.get(username)
+        if known_ids:
+            cursors.append(max(known_ids))
+            bounds.append(tweet_id_timestamp(max(known_ids)))
+        elif checked_at:
+            bounds.append(checked_at.replace(tzinfo=timezone.utc).timestamp())
+
+    if not bounds:
+        return None, None
+    if len(cursors) == len(usernames) and min(bounds) >= window_start:
+        return str(min(cursors)), None
+    # 範囲外の since_id は API に拒否されるため、範囲内の時刻に丸めて取得する
+    started = max(min(bounds), window_start)
+    return None, datetime.utcfromtimestamp(started)
+
+
+async def check_search_batch(query, usernames, channels_by_username, semaphore):
+    """1クエリ分を取得し、author_id でアカウントごとに振り分けて投稿"""
+    results = {}
+    try:
+        since_id, start_time = search_lower_bound(usernames)
+        max_pages = SEARCH_MAX_PAGES if since_id or start_time else 1
+        fetch_started = datetime.utcnow()
+
+        tweets = []
+        next_token = None
+        async with semaphore:
+            for _ in range(max_pages):
+                page = await twitter_api.search_recent_tweets(
+                    query, since_id=since_id, next_token=next_token, start_time=start_time
+                )
+                if page is None:
+                    tweets = None
+                    break
+                page_tweets, next_token = page
+                tweets.extend(page_tweets)
+                if not next_token:
+                    break
+            if next_token:
+                logger.warning(f"Search results truncated after {max_pages} pages for query: {query}")
+
+        # 取得に成功したら最新のIDをクエリ内の全アカウントの次回 since_id にする
+        # （振り分け後の last_tweet_ids は各アカウントの配信済み位置として別に管理する）
+        if tweets:
+            newest_id = str(max(int(tweet.id) for tweet in tweets))
+            for username in usernames:
+                search_since_ids[username] = newest_id
+
+        # author_id → ユーザー名で振り分け（レスポンスは新しい順なのでアカウント内の順序も新しい順）
+        username_by_id = {TARGET_ACCOUNTS[username]: username for username in usernames}
+        tweets_by_username = {username: [] for username in usernames}
+        for tweet in tweets or []:
+            username = username_by_id.get(tweet.author_id)
+            if username:
+                tweets_by_username[username].append(tweet)
+
+        async def deliver(username):
+            account_tweets = None if tweets is None else tweets_by_username[username]
+            last_id = last_tweet_ids[username]
+            checked_at = last_checked_at.get(username)
+            if account_tweets and last_id:
+                account_tweets = [tweet for tweet in account_tweets if int(tweet.id) > int(last_id)]
+            elif account_tweets and checked_at:
+                account_tweets = [
+                    tweet for tweet in account_tweets
+                    if tweet.created_at_datetime and tweet.created_at_datetime >= checked_at
+                ]
+            if account_tweets is not None:
+                budget_tracker.attribute(username, len(tweets_by_username[username]))
+
+            incremental = last_id is not None or checked_at is not None
+            try:
+                results[username] = await handle_fetched_tweets(
+                    username, channels_by_username[username], account_tweets, incremental, fetch_started
+                )
+                if account_tweets and username in delivery_backlog:
+                    # 配信に失敗した分は次回の検索で取り直す
+                    if last_tweet_ids[username]:
+                        search_since_ids[username] = last_tweet_ids[username]
+                    else:
+                        search_since_ids.pop(username, None)
+            except Exception as e:
+                logger.error(f"Error posting for {username}: {e}")
+            finally:
+                save_state(username)
+
+        # アカウントごとの投稿は並行して行う（各アカウント内の順序は保たれる）
+        await asyncio.gather(*(deliver(username) for username in usernames))
+
+    except Exception as e:
+        logger.error(f"Error checking search batch {usernames}: {e}")
+
+    return results
+
+
+# アダプティブポーリング（アカウントごとに次回チェック時刻を管理）
+class PollScheduler:
+    """アカウントごとの次回チェック時刻を優先度付きキューで管理するスケジューラ
+
+    投稿頻度（指数移動平均）と月間予算の消費ペースからポーリング間隔を調整する。
+    """
+
+    def __init__(self):
+        self.heap = []       # (次回チェック時刻 epoch秒, username)
+        self.due = {}        # username -> 次回チェック時刻（ヒープ内の古い要素の判定用）
+        self.rates = {}      # username -> 投稿頻度（ツイート/時）
+        self.last_polled = {}  # username -> 前回チェック時刻 epoch秒
+        self.task = None
+        self.running_since = None  # 起動待機後にループを開始した時刻
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    def schedule(self, username, delay):
+        """delay 秒後にチェックを予約"""
+        due = time.time() + delay
+        self.due[username] = due
+        heapq.heappush(self.heap, (due, username))
+
+    def sync_accounts(self):
+        """TARGET_ACCOUNTS の追加・削除（複数ワーカー構成ではリースの増減）をスケジュールに反映"""
+        for username in TARGET_ACCOUNTS:
+            if username not in self.due and shard_coordinator.owns(username):
+                self.schedule(username, 0)
+        for username in list(self.due):
+            if username not in TARGET_ACCOUNTS or not shard_coordinator.owns(username):
+                del self.due[username]
+
+    def interval_bounds(self, username):
+        return ACCOUNT_POLL_INTERVALS.get(username, (POLL_MIN_INTERVAL, POLL_MAX_INTERVAL))
+
+    def observe(self, username, new_count):
+        """チェック結果から投稿頻度を更新"""
+        if new_count is None:
+            return
+        now = time.time()
+        last = self.last_polled.get(username)
+        self.last_polled[username] = now
+        if last is None:
+            return
+
+        hours = max((now - last) / 3600, 1 / 60)
+        observed = new_count / hours
+        previous = self.rates.get(username)
+        if previous is None:
+            self.rates[username] = observed
+        else:
+            self.rates[username] = POLL_RATE_SMOOTHING * observed + (1 - POLL_RATE_SMOOTHING) * previous
+
+    def next_interval(self, username):
+        """次回チェックまでの間隔（秒）"""
+        min_interval, max_interval = self.interval_bounds(username)
+        rate = self.rates.get(username)
+
+        if rate is None:
+            interval = POLL_DEFAULT_INTERVAL
+        elif rate > 0:
+            interval = POLL_TARGET_TWEETS / rate * 3600
+        else:
+            interval = max_interval
+
+        # 予測使用量が上限を超えそうなら間隔を広げ、余裕があれば縮める
+        interval *= budget_tracker.pressure()
+        interval = min(max(interval, min_interval), max_interval)
+
+        # 全アカウントの合計リクエスト数がレート制限内に収まる間隔を下限にする
+        if FETCH_MODE == "search":
+            limiter = rate_limiter.endpoint("search_recent")
+            requests_per_cycle = len(build_search_queries(TARGET_ACCOUNTS, SEARCH_QUERY_MAX_LENGTH))
+        else:
+            limiter = rate_limiter.endpoint("user_tweets")
+            requests_per_cycle = len(TARGET_ACCOUNTS)
+        floor = requests_per_cycle * limiter.window_duration / max(limiter.requests_per_window, 1)
+        return max(interval, floor)
 
-# 最新ツイートIDの保存
-last_tweet_ids = {account: None for account in TARGET_ACCOUNTS}
+    def next_delay(self, username):
+        """スキップ中のアカウントはスキップ解除まで待つ"""
+        delay = self.next_interval(username)
+        until = skip_until.get(username)
+        if until:
+            delay = max(delay, (until - datetime.utcnow()).total_seconds())
+        return delay
+
+    def pop_due(self):
+        """期限が来たアカウントをすべて取り出す"""
+        now = time.time()
+        usernames = []
+        while self.heap and self.heap[0][0] <= now:
+            due, username = heapq.heappop(self.heap)
+            if self.due.get(username) == due:
+                usernames.append(username)
+        return usernames
+
+    def overdue_seconds(self):
+        """最も古い予定時刻からの超過秒数（ループ開始前は 0）"""
+        if self.running_since is None or not self.due:
+            return 0.0
+        return max(time.time() - max(min(self.due.values()), self.running_since), 0.0)
+
+    def average_interval(self):
+        """現在の平均ポーリング間隔（秒）"""
+        if not TARGET_ACCOUNTS:
+            return POLL_DEFAULT_INTERVAL
+        return sum(self.next_interval(username) for username in TARGET_ACCOUNTS) / len(TARGET_ACCOUNTS)
+
+    def to_state(self):
+        return {"due": dict(self.due), "rates": dict(self.rates), "last_polled": dict(self.last_polled)}
+
+    def load_state(self, state):
+        if not state:
+            return
+        self.rates = state.get("rates", {})
+        self.last_polled = state.get("last_polled", {})
+        for username, due in state.get("due", {}).items():
+            if username in TARGET_ACCOUNTS:
+                self.due[username] = due
+                heapq.heappush(self.heap, (due, username))
+
+    async def run(self):
+        await wait_until_ready()
+
+        # 初期化を遅延実行（レート制限対策）。webhook モードは安定を待つ接続が無いのですぐ始める
+        if DELIVERY_MODE != "webhook":
+            logger.info("Waiting 30 seconds before first check to stabilize connection...")
+            await asyncio.sleep(30)  # 30秒待機
+
+        logger.info("Twitter API bot is ready, starting adaptive polling...")
+        self.running_since = time.time()
+        while True:
+            try:
+                self.sync_accounts()
+                usernames = self.pop_due()
+                if not usernames:
+                    # 次の期限まで待機（アカウント追加に備えて最大60秒ごとに再確認）
+                    next_due = self.heap[0][0] if self.heap else time.time() + 60
+                    await asyncio.sleep(min(max(next_due - time.time(), 0), 60))
+                    continue
+
+                results = await check_and_post_updates(usernames)
+                for username in usernames:
+                    self.observe(username, results.get(username))
+                    # 遮断中のアカウントは解除されるまで待つ
+                    delay = max(self.next_delay(username), account_breakers.get(username).retry_after())
+                    self.schedule(username, delay)
+                    logger.info("Next check for %s in %.1f minutes", username, delay / 60, extra=sampled("next_check"))
+                await state_store.run(state_store.set_json, "scheduler", self.to_state())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error in poll scheduler: {e}")
+                await asyncio.sleep(60)
+
+
+poll_scheduler = PollScheduler()
+poll_scheduler.load_state(state_store.get_json("scheduler"))
+
+
+# 複数プロセスでのアカウント分担
+class ShardCoordinator:
+    """共有SQLiteのリース表で監視アカウントをワーカー間に均等に割り当てる
+
+    各ワーカーは定期的にリースを更新し、生存ワーカー数で割った担当数まで空きアカウントを取得する。
+    更新が途絶えたワーカーのリースは SHARD_LEASE_TTL 秒で失効し、残りのワーカーが引き継ぐ。
+    月間予算の実績も同じタイミングで共有ストアと同期する。
+    """
+
+    def __init__(self, enabled, worker_id, ttl, interval):
+        self.enabled = enabled
+        self.worker_id = worker_id
+        self.ttl = ttl
+        self.interval = interval
+        self.owned = set()
+        self.workers = []        # 生存しているワーカーID（昇順、先頭がリーダー）
+        self.renewed_at = None
+        self.task = None
+
+    def owns(self, username):
+        return not self.enabled or username in self.owned
+
+    def is_leader(self):
+        """コマンドに応答するワーカーか（単独動作時は常に True）"""
+        return not self.enabled or (bool(self.workers) and self.workers[0] == self.worker_id)
+
+    async def renew(self):
+        """リースを更新して担当アカウントを再計算（SQLiteのロック待ちは書き込み用スレッドで行う）"""
+        owned, self.workers = await state_store.run(
+            state_store.renew_leases, self.worker_id, list(TARGET_ACCOUNTS), self.ttl, keep=set(in_flight_checks)
+        )
+        if FETCH_MODE == "stream":
+            # ストリームはリーダーだけが接続するので、取りこぼしの補完と状態の保存もリーダーが全アカウント分行う
+            owned = set(TARGET_ACCOUNTS) if self.is_leader() else set()
+        gained = owned - self.owned
+        lost = self.owned - owned
+        if gained:
+            # 他のワーカーが最後に保存した位置から引き継ぐ
+            restore_accounts(gained, await state_store.run(state_store.load_accounts))
+            logger.info(f"Acquired {len(gained)} account leases: {sorted(gained)}")
+        if lost:
+            logger.info(f"Released {len(lost)} account leases: {sorted(lost)}")
+        self.owned = owned
+        self.renewed_at = time.time()
+        await budget_tracker.sync_shared(state_store)
+
+    async def start(self):
+        if self.enabled and (self.task is None or self.task.done()):
+            await self.renew()
+            logger.info(f"Worker {self.worker_id} owns {len(self.owned)}/{len(TARGET_ACCOUNTS)} accounts "
+                        f"({len(self.workers)} workers)")
+            self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.renew()
+            except Exception as e:
+                logger.error(f"Error renewing shard leases: {e}")
+
+    async def release(self):
+        """停止時にリースを手放して他のワーカーにすぐ引き継ぐ"""
+        if not self.enabled:
+            return
+        if self.task is not None:
+            self.task.cancel()
+        try:
+            await budget_tracker.sync_shared(state_store)
+            await state_store.run(state_store.release_leases, self.worker_id)
+            logger.info(f"Released all leases for worker {self.worker_id}")
+        except Exception as e:
+            logger.error(f"Error releasing shard leases: {e}")
+
+
+shard_coordinator = ShardCoordinator(SHARDING, WORKER_ID, SHARD_LEASE_TTL, SHARD_RENEW_INTERVAL)
+
+
+# フィルタードストリームでの受信（FETCH_MODE=stream）
+class StreamConsumer:
+    """TARGET_ACCOUNTS から作ったルールでフィルタードストリームを購読し、届いたツイートをすぐ投稿する
+
+    切断・無通信（keep-alive 途絶）を検知したら指数バックオフ＋ジッタで再接続し、
+    接続し直すたびに切断中の取りこぼしをタイムライン取得（since_id）で補完する。
+    受信したツイートは deliver_loop が補完と直列に配信し、配信できた分だけ位置を進める。
+    複数ワーカー構成ではリーダーだけが接続し、全アカウントを受け持つ。
+    """
 
-# レート制限管理（無料プラン対応版）
-class RateLimiter:
     def __init__(self):
-        # Twitter API v2 無料プランの制限に合わせる
-        self.requests_per_window = 10  # 15分あたり10リクエスト（無料プラン）
-        self.window_duration = 900     # 15分 = 900秒
-        self.requests = []
-        self.monthly_count = 0
-        self.monthly_limit = 10000    # 月間10,000ツイート
-        self.month_start = datetime.now()
-        self.min_request_interval = 180  # 最小180秒間隔（3分間隔で安全性向上）
-        self.last_request_time = None
-    
-    async def wait_if_needed(self):
-        """必要に応じて待機"""
-        now = datetime.now()
-        
-        # 最小リクエスト間隔のチェック（90秒）
-        if self.last_request_time:
-            elapsed = (now - self.last_request_time).total_seconds()
-            if elapsed < self.min_request_interval:
-                wait_time = self.min_request_interval - elapsed
-                logger.info(f"Waiting {wait_time:.1f}s for minimum interval (3min safety)...")
-                await asyncio.sleep(wait_time)
-                now = datetime.now()
-        
-        # 月間制限チェック（ツイート数で計算）
-        # 1リクエストで20ツイート取得 × 月間リクエスト数
-        estimated_monthly_tweets = self.monthly_count * 20
-        if estimated_monthly_tweets >= self.monthly_limit:
-            logger.error("Monthly tweet limit exceeded! Waiting until next month...")
+        self.task = None
+        self.connected = False
+        self.connected_at = None
+        self.last_data_at = None
+        self.failures = 0        # 連続した接続失敗の回数
+        self.synced_rules = None  # 最後に登録したルール値の集合
+        self.incoming = asyncio.Queue()  # 配信待ちの (username, ツイート)。None は取りこぼしの補完要求
+        self.worker = None
+        self.next_resync = 0.0    # 配信に失敗したアカウントを次に取り直す時刻（monotonic）
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+        if self.worker is None or self.worker.done():
+            self.worker = asyncio.create_task(self.deliver_loop())
+
+    async def sync_rules(self):
+        """このBotのルール（タグで識別）を TARGET_ACCOUNTS に合わせる"""
+        desired = {query for query, _ in build_search_queries(TARGET_ACCOUNTS, STREAM_RULE_MAX_LENGTH)}
+        if desired == self.synced_rules:
+            return True
+        existing = await twitter_api.get_stream_rules()
+        if existing is None:
             return False
-        
-        # 月間リセット
-        if (now - self.month_start).days >= 30:
-            self.monthly_count = 0
-            self.month_start = now
-        
-        # 15分間のウィンドウをクリア
-        cutoff = now - timedelta(seconds=self.window_duration)
-        self.requests = [req_time for req_time in self.requests if req_time > cutoff]
-        
-        # レート制限チェック（10リクエスト/15分）
-        if len(self.requests) >= self.requests_per_window:
-            sleep_time = self.window_duration - (now - self.requests[0]).total_seconds()
-            if sleep_time > 0:
-                logger.warning(f"Rate limit reached (10 req/15min). Waiting {sleep_time:.1f} seconds...")
-                await asyncio.sleep(sleep_time)
-                return await self.wait_if_needed()
-        
-        # リクエストを記録
-        self.requests.append(now)
-        self.monthly_count += 1
-        self.last_request_time = now
-        estimated_monthly_tweets = self.monthly_count * 20
-        logger.info(f"API Request #{self.monthly_count} (≈{estimated_monthly_tweets} tweets/10000 this month)")
+        ours = {rule["value"]: rule["id"] for rule in existing if rule.get("tag") == STREAM_RULE_TAG}
+        stale = [rule_id for value, rule_id in ours.items() if value not in desired]
+        missing = [value for value in desired if value not in ours]
+        if (stale or missing) and not await twitter_api.update_stream_rules(add=missing, delete_ids=stale):
+            return False
+        logger.info(f"Stream rules synced ({len(desired)} rules, +{len(missing)} / -{len(stale)})")
+        self.synced_rules = desired
         return True
 
-class TwitterAPI:
-    def __init__(self, bearer_token):
-        if not bearer_token:
-            raise ValueError("Bearer token is required")
-        self.bearer_token = bearer_token
-        self.base_url = "https://api.twitter.com/2"
+    def backoff(self, retry_at=None):
+        """次の再接続までの秒数"""
+        delay = min(STREAM_BACKOFF_BASE * 2 ** max(self.failures - 1, 0), STREAM_BACKOFF_MAX)
+        delay = random.uniform(delay / 2, delay)
+        if retry_at is not None:
+            delay = max(delay, retry_at - time.time())
+        return delay
 
-    async def get_user_id(self, username):
-        """ユーザー名からユーザーIDを取得"""
-        if not await rate_limiter.wait_if_needed():
-            return None
+    def on_connect(self):
+        self.connected = True
+        self.connected_at = self.last_data_at = time.time()
+        self.failures = 0
+        logger.info("Connected to filtered stream")
+        # 切断していた間（初回は前回の停止以降）の投稿をタイムラインから補完する
+        # 以降に受信したツイートは補完が終わるまで配信しない（古いツイートが後から投稿されないように）
+        self.incoming.put_nowait(None)
 
-        url = f"{self.base_url}/users/by/username/{username}"
-        headers = {"Authorization": f"Bearer {self.bearer_token}"}
+    def on_data(self):
+        self.last_data_at = time.time()
 
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, headers=headers) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        logger.info(f"Got user ID for {username}: {data['data']['id']}")
-                        return data["data"]["id"]
-                    elif response.status == 429:
-                        logger.error("Rate limit exceeded from Twitter API")
-                        await asyncio.sleep(300)  # 5分待機
-                        return None
-                    elif response.status == 401:
-                        logger.error("Invalid Twitter Bearer Token")
-                        return None
-                    elif response.status == 404:
-                        logger.error(f"User {username} not found")
-                        return None
-                    else:
-                        logger.error(f"Failed to get user ID for {username}: HTTP {response.status}")
-                        response_text = await response.text()
-                        logger.error(f"Response: {response_text}")
-                        return None
-        except Exception as e:
-            logger.error(f"Error getting user ID for {username}: {e}")
-            return None
+    async def run(self):
+        await wait_until_ready()
+        while True:
+            retry_at = None
+            try:
+                if not shard_coordinator.is_leader():
+                    await asyncio.sleep(SHARD_RENEW_INTERVAL)
+                    continue
+                if any(user_id is None for user_id in TARGET_ACCOUNTS.values()):
+                    async with user_id_init_lock:
+                        await initialize_user_ids()
+                if not await self.sync_rules():
+                    raise StreamError("could not sync stream rules")
 
-    async def get_user_tweets(self, user_id, username, max_results=5):
-        """ユーザーの最新ツイートを取得（画像・メディア対応 + スキップ対応）"""
-        if not await rate_limiter.wait_if_needed():
-            return []
+                stream = twitter_api.stream_tweets(on_connect=self.on_connect, on_data=self.on_data)
+                async with contextlib.aclosing(stream):
+                    async for tweet in stream:
+                        await self.handle(tweet)
+                        if not shard_coordinator.is_leader():
+                            logger.info("No longer the leader, disconnecting from filtered stream")
+                            break
+                if shard_coordinator.is_leader():
+                    logger.warning("Filtered stream closed by server")
+            except asyncio.CancelledError:
+                raise
+            except asyncio.TimeoutError:
+                logger.warning(f"No data from filtered stream for {STREAM_HEARTBEAT_TIMEOUT:.0f}s, reconnecting")
+            except StreamError as e:
+                retry_at = e.retry_at
+                logger.error(f"Filtered stream connection failed: {e}")
+            except Exception as e:
+                logger.error(f"Filtered stream error: {e}")
 
-        url = f"{self.base_url}/users/{user_id}/tweets"
-        headers = {"Authorization": f"Bearer {self.bearer_token}"}
-        max_results = max(5, min(max_results, 100))
+            if self.connected:
+                STREAM_RECONNECTS.inc()
+            self.connected = False
+            self.failures += 1
+            delay = self.backoff(retry_at)
+            logger.info(f"Reconnecting to filtered stream in {delay:.1f}s")
+            await asyncio.sleep(delay)
 
-        params = {
-            "max_results": max_results,
-            "tweet.fields": "created_at,attachments",
-            "media.fields": "url,preview_image_url,type",
-            "expansions": "attachments.media_keys",
-            "exclude": "retweets,replies"
-        }
+    async def handle(self, tweet):
+        """ストリームで届いた1件を配信待ちに積む（配信は deliver_loop に任せて次の行の読み取りに戻る）"""
+        username = next((name for name, user_id in TARGET_ACCOUNTS.items() if user_id == tweet.author_id), None)
+        if username is None or not shard_coordinator.owns(username):
+            return
+        last_id = last_tweet_ids.get(username)
+        if last_id and int(tweet.id) <= int(last_id):
+            return  # タイムライン補完で配信済み
 
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, headers=headers, params=params) as response:
-                    # レート制限の詳細情報をログ出力
-                    rate_limit_remaining = response.headers.get('x-rate-limit-remaining', 'Unknown')
-                    rate_limit_reset = response.headers.get('x-rate-limit-reset', 'Unknown')
-                    rate_limit_limit = response.headers.get('x-rate-limit-limit', 'Unknown')
-                    
-                    logger.info(f"Rate limit info - Remaining: {rate_limit_remaining}, Limit: {rate_limit_limit}, Reset: {rate_limit_reset}")
-                    
-                    if response.status == 200:
-                        data = await response.json()
-                        tweets = data.get("data", [])
-                        media_info = data.get("includes", {}).get("media", [])
+        budget_tracker.record("search_stream", 1, username, requests=0)
+        self.incoming.put_nowait((username, tweet))
 
-                        for tweet in tweets:
-                            tweet['media_info'] = []
-                            if 'attachments' in tweet and 'media_keys' in tweet['attachments']:
-                                for media_key in tweet['attachments']['media_keys']:
-                                    for media in media_info:
-                                        if media['media_key'] == media_key:
-                                            tweet['media_info'].append(media)
+    async def deliver_loop(self):
+        """配信待ちのツイートを溜まった分ずつ配信する（補完・取り直しと同じタスクで順に行う）"""
+        while True:
+            timeout = max(self.next_resync - time.monotonic(), 0) if delivery_backlog else None
+            items = []
+            try:
+                items.append(await asyncio.wait_for(self.incoming.get(), timeout))
+            except asyncio.TimeoutError:
+                pass
+            while not self.incoming.empty():
+                items.append(self.incoming.get_nowait())
+            try:
+                await self.deliver(items)
+            except Exception as e:
+                logger.error(f"Error delivering streamed tweets: {e}")
+            finally:
+                for _ in items:
+                    self.incoming.task_done()
 
-                        logger.info(f"Retrieved {len(tweets)} tweets for user {user_id}")
-                        return tweets
+    async def deliver(self, items):
+        if None in items:
+            await check_and_post_updates()
+        elif delivery_backlog and time.monotonic() >= self.next_resync:
+            # 配信に失敗して止まっているアカウントはタイムラインから取り直す
+            await check_and_post_updates(sorted(delivery_backlog))
 
-                    elif response.status == 429:
-                        logger.error("Rate limit exceeded from Twitter API")
-                        response_text = await response.text()
-                        logger.error(f"Rate limit response: {response_text}")
-                        skip_until[username] = datetime.utcnow() + timedelta(minutes=15)
-                        logger.warning(f"Temporarily skipping {username} for 15 minutes.")
-                        await asyncio.sleep(300)
-                        return []
+        tweets_by_username = {}
+        for item in items:
+            if item is not None:
+                username, tweet = item
+                tweets_by_username.setdefault(username, []).append(tweet)
+        if tweets_by_username:
+            await asyncio.gather(*(
+                self.deliver_account(username, tweets) for username, tweets in tweets_by_username.items()
+            ))
+            await flush_state()
+        if delivery_backlog and self.next_resync <= time.monotonic():
+            self.next_resync = time.monotonic() + STREAM_RESYNC_INTERVAL
 
-                    elif response.status == 401:
-                        logger.error("Invalid Twitter Bearer Token")
-                        response_text = await response.text()
-                        logger.error(f"Auth error response: {response_text}")
-                        return []
+    async def deliver_account(self, username, tweets):
+        """1アカウント分を古い順に配信し、配信できた位置まで進める"""
+        if username in delivery_backlog:
+            # 失敗したツイートを飛ばさないよう、取り直しで追いつくまでストリームからは配信しない
+            logger.info(f"Deferring {len(tweets)} streamed tweets for {username} until its backlog is refetched")
+            return
+        last_id = last_tweet_ids.get(username)
+        tweets = sorted(
+            (tweet for tweet in tweets if not last_id or int(tweet.id) > int(last_id)),
+            key=lambda tweet: int(tweet.id),
+        )
+        if not tweets:
+            return
+        channels = resolve_destinations(username)
+        if not channels:
+            logger.error(f"No available destination channels for {username}, skipping")
+            return
+        received_at = datetime.utcnow()
+        delivered_id = await deliver_tweets(username, channels, tweets)
+        advance_cursor(username, delivered_id, tweets[-1].id, received_at)
+        save_state(username)
 
-                    else:
-                        logger.error(f"Failed to get tweets for user {user_id}: HTTP {response.status}")
-                        response_text = await response.text()
-                        logger.error(f"Response: {response_text}")
-                        return []
 
-        except Exception as e:
-            logger.error(f"Error getting tweets for user {user_id}: {e}")
-            return []
+stream_consumer = StreamConsumer()
 
-# 初期化時のエラーハンドリング強化
-def validate_environment():
-    """環境変数の検証"""
-    errors = []
-    
-    if not DISCORD_TOKEN:
-        errors.append("DISCORD_TOKEN is not set")
-    
-    if not CHANNEL_ID:
-        errors.append("CHANNEL_ID is not set or invalid")
-    
-    if not TWITTER_BEARER_TOKEN:
-        errors.append("TWITTER_BEARER_TOKEN is not set")
-    
-    if errors:
-        for error in errors:
-            logger.error(error)
-        return False
-    
-    return True
+# ステータス表示用のスナップショット（コマンドはポーリング処理に触れずにこれを読む）
+@dataclass(frozen=True, slots=True)
+class StatusSnapshot:
+    taken_at: datetime
+    requests: int
+    tweets: int
+    monthly_limit: int
+    remaining: int
+    forecast: float
+    daily_rate: float
+    spend_ceiling: float
+    pressure: float
+    cycle_start: datetime
+    cycle_end: datetime
+    top_accounts: tuple      # ((username, tweets, requests), ...) 取得数の多い順
+    endpoints: tuple         # ((name, used, limit, next_reset), ...)
+    open_circuits: tuple     # ((scope, key, state, retry_after), ...)
+    average_interval: float
+    accounts_initialized: int
+    accounts_total: int
+    destination_count: int
 
-# 環境変数検証後にTwitterAPI初期化
-if validate_environment():
-    rate_limiter = RateLimiter()
-    twitter_api = TwitterAPI(TWITTER_BEARER_TOKEN)
-else:
-    logger.error("Environment validation failed. Exiting...")
-    exit(1)
 
-async def initialize_user_ids():
-    """起動時にユーザーIDを取得"""
-    logger.info(f"Initializing user IDs for accounts: {list(TARGET_ACCOUNTS.keys())}")
-    
-    for username in TARGET_ACCOUNTS:
-        if TARGET_ACCOUNTS[username] is not None:
-            logger.info(f"User ID for {username} already initialized: {TARGET_ACCOUNTS[username]}")
-            continue
-            
-        try:
-            user_id = await twitter_api.get_user_id(username)
-            if user_id:
-                TARGET_ACCOUNTS[username] = user_id
-                logger.info(f"✅ Initialized user ID for {username}: {user_id}")
-            else:
-                logger.error(f"❌ Failed to get user ID for {username}")
-            
-            # ユーザーID取得間の待機時間（レート制限を考慮して待機しない、RateLimiterが管理）
-        except Exception as e:
-            logger.error(f"Error initializing {username}: {e}")
+status_snapshot = None
 
-async def check_and_post_updates():
-    """新規ツイートをチェックしてDiscordに送信（複数投稿対応 + スキップ管理）"""
-    await bot.wait_until_ready()
-    channel = bot.get_channel(CHANNEL_ID)
-    
-    if not channel:
-        logger.error(f"Discord channel not found (ID: {CHANNEL_ID})")
-        return
-    
-    bot_member = channel.guild.get_member(bot.user.id)
-    if bot_member and not channel.permissions_for(bot_member).send_messages:
-        logger.error(f"❌ Bot doesn't have permission to send messages in channel {CHANNEL_ID}")
-        return
+def refresh_status_snapshot():
+    """現在の状態からスナップショットを作り直す"""
+    global status_snapshot
+    try:
+        top_accounts = sorted(budget_tracker.accounts.items(), key=lambda item: item[1]["tweets"], reverse=True)[:5]
+        status_snapshot = StatusSnapshot(
+            taken_at=datetime.utcnow(),
+            requests=budget_tracker.requests,
+            tweets=budget_tracker.tweets,
+            monthly_limit=budget_tracker.monthly_limit,
+            remaining=budget_tracker.remaining(),
+            forecast=budget_tracker.forecast(),
+            daily_rate=budget_tracker.daily_rate(),
+            spend_ceiling=budget_tracker.spend_ceiling,
+            pressure=budget_tracker.pressure(),
+            cycle_start=budget_tracker.cycle_start,
+            cycle_end=budget_tracker.cycle_end,
+            top_accounts=tuple((username, stats["tweets"], stats["requests"]) for username, stats in top_accounts),
+            endpoints=tuple(
+                (name, limiter.used_in_window(), limiter.requests_per_window, limiter.next_reset())
+                for name, limiter in rate_limiter.endpoints.items()
+            ),
+            open_circuits=tuple(
+                (breakers.scope, key, breaker.state, breaker.retry_after())
+                for breakers in (endpoint_breakers, account_breakers)
+                for key, breaker in breakers.open_circuits().items()
+            ),
+            average_interval=poll_scheduler.average_interval(),
+            accounts_initialized=len([v for v in TARGET_ACCOUNTS.values() if v is not None]),
+            accounts_total=len(TARGET_ACCOUNTS),
+            destination_count=len(all_destination_channel_ids()),
+        )
+    except Exception as e:
+        logger.error(f"Error refreshing status snapshot: {e}")
 
-    logger.info("Checking for new tweets (rate-limited)...")
-    
-    # 初回のユーザーID取得
-    if None in TARGET_ACCOUNTS.values():
-        logger.info("Some accounts not initialized, initializing now...")
-        await initialize_user_ids()
-    
-    now = datetime.utcnow()
-    active_accounts = {
-        k: v for k, v in TARGET_ACCOUNTS.items()
-        if v is not None and (k not in skip_until or skip_until[k] <= now)
+def get_status_snapshot():
+    """キャッシュ済みのスナップショット（未作成なら作成）"""
+    if status_snapshot is None:
+        refresh_status_snapshot()
+    return status_snapshot
+
+
+# 手動チェックジョブ（コマンドはジョブを登録してすぐに応答する）
+@dataclass(slots=True)
+class CheckJob:
+    id: str
+    requested_by: str
+    created_at: datetime
+    status: str = "queued"  # queued / running / done / failed
+    total: int = 0
+    completed: int = 0
+    failed: int = 0
+    new_tweets: int = 0
+    finished_at: datetime | None = None
+    error: str | None = None
+    scope: str | None = None  # 一部のアカウントだけが対象の場合の説明（複数ワーカー構成）
+    task: asyncio.Task | None = None
+
+    def record(self, result):
+        """1アカウント分の結果を記録（result は新規ツイート数、失敗時は None）"""
+        self.completed += 1
+        if result is None:
+            self.failed += 1
+        else:
+            self.new_tweets += result
+
+
+check_jobs = OrderedDict()
+_check_job_ids = itertools.count(1)
+
+def check_scope_note():
+    """手動チェックがこのワーカーの担当分に限られる場合の説明（全アカウントが対象なら None）
+
+    他のワーカーのアカウントは取得すると担当ワーカーと位置の保存が競合するため、手動チェックでも対象にしない。
+    """
+    owned = sum(1 for username in TARGET_ACCOUNTS if shard_coordinator.owns(username))
+    if owned == len(TARGET_ACCOUNTS):
+        return None
+    return (f"このワーカー（{shard_coordinator.worker_id}）が担当する {owned}/{len(TARGET_ACCOUNTS)} アカウントのみが対象です。"
+            "他のアカウントは担当ワーカーの定期チェックで取得されます。")
+
+def start_check_job(requested_by):
+    """チェックジョブをバックグラウンドで開始"""
+    job = CheckJob(id=str(next(_check_job_ids)), requested_by=requested_by, created_at=datetime.utcnow(),
+                   scope=check_scope_note())
+    job.task = asyncio.create_task(run_check_job(job))
+    check_jobs[job.id] = job
+    while len(check_jobs) > MAX_CHECK_JOBS:
+        check_jobs.popitem(last=False)
+    logger.info(f"Started check job {job.id} (requested by {requested_by})")
+    return job
+
+async def run_check_job(job):
+    job.status = "running"
+    try:
+        await check_and_post_updates(job=job)
+        job.status = "done"
+    except Exception as e:
+        job.status = "failed"
+        job.error = str(e)
+        logger.error(f"Check job {job.id} failed: {e}")
+    finally:
+        job.finished_at = datetime.utcnow()
+
+def build_job_embed(job):
+    """ジョブの進捗・結果を表示する埋め込み"""
+    titles = {"queued": "⏳ 待機中", "running": "🔍 実行中", "done": "✅ 完了", "failed": "❌ 失敗"}
+    embed = discord.Embed(
+        title=f"チェックジョブ #{job.id} - {titles.get(job.status, job.status)}",
+        description=f"⚠️ {job.scope}" if job.scope else None,
+        color=0xff0000 if job.status == "failed" else 0x1DA1F2,
+    )
+    embed.add_field(name="進捗", value=f"{job.completed}/{job.total}アカウント", inline=True)
+    embed.add_field(name="新規ツイート", value=f"{job.new_tweets}件", inline=True)
+    embed.add_field(name="失敗", value=f"{job.failed}アカウント", inline=True)
+    embed.add_field(name="依頼者", value=job.requested_by, inline=True)
+    started = job.created_at.replace(tzinfo=timezone.utc)
+    embed.add_field(name="開始", value=f"<t:{int(started.timestamp())}:R>", inline=True)
+    if job.finished_at:
+        finished = job.finished_at.replace(tzinfo=timezone.utc)
+        embed.add_field(name="終了", value=f"<t:{int(finished.timestamp())}:R>", inline=True)
+    if job.error:
+        embed.add_field(name="エラー", value=job.error[:1000], inline=False)
+    return embed
+
+def find_job(job_id=None):
+    """ジョブIDからジョブを取得（省略時は最新のジョブ）"""
+    if job_id is None:
+        return next(reversed(check_jobs.values()), None)
+    return check_jobs.get(job_id.lstrip("#"))
+
+
+# メトリクス（/metrics で Prometheus 形式で公開）
+def tweet_id_timestamp(tweet_id):
+    """ツイートID（Snowflake）から投稿時刻（epoch秒）を取得"""
+    return ((int(tweet_id) >> 22) + 1288834974657) / 1000
+
+
+def _rate_limit_remaining():
+    return {
+        name: limiter.requests_per_window - limiter.used_in_window()
+        for name, limiter in rate_limiter.endpoints.items()
     }
-    logger.info(f"Active accounts: {len(active_accounts)}/{len(TARGET_ACCOUNTS)}")
 
-    for username, user_id in active_accounts.items():
-        try:
-            logger.info(f"Checking {username} (ID: {user_id})...")
-            tweets = await twitter_api.get_user_tweets(user_id, username, max_results=20)
-            
-            if tweets:
-                new_tweets = []
 
-                for tweet in tweets:
-                    tweet_id = tweet["id"]
-                    if last_tweet_ids[username] is None:
-                        new_tweets = [tweets[0]]
-                        break
-                    elif tweet_id == last_tweet_ids[username]:
-                        break
-                    else:
-                        new_tweets.append(tweet)
-
-                if tweets:
-                    last_tweet_ids[username] = tweets[0]["id"]
-
-                for tweet in reversed(new_tweets):
-                    logger.info(f"🆕 New tweet found for {username}: {tweet['id']}")
-                    try:
-                        embed = discord.Embed(
-                            description=tweet["text"],
-                            color=0x1DA1F2,
-                            timestamp=datetime.utcnow()
-                        )
-
-                        if tweet.get('media_info'):
-                            for media in tweet['media_info']:
-                                if media['type'] == 'photo' and 'url' in media:
-                                    embed.set_image(url=media['url'])
-                                    break
-                                elif media['type'] == 'video' and 'preview_image_url' in media:
-                                    embed.set_image(url=media['preview_image_url'])
-                                    break
-
-                        await channel.send(embed=embed)
-                        logger.info(f"✅ Posted update for {username} to Discord")
-                        await asyncio.sleep(2)
-                    except discord.Forbidden:
-                        logger.error("❌ Permission denied: Cannot send messages to this channel")
-                        return
-                    except Exception as e:
-                        logger.error(f"Error posting to Discord: {e}")
-            else:
-                logger.info(f"No new tweets for {username}")
-                
-        except Exception as e:
-            logger.error(f"Error checking {username}: {e}")
+def _last_tweet_age():
+    now = time.time()
+    return {
+        username: now - tweet_id_timestamp(tweet_id)
+        for username, tweet_id in last_tweet_ids.items()
+        if tweet_id
+    }
 
 
-# 定期実行タスク（3時間間隔 - 月間制限対応）
-@tasks.loop(hours=3)  # 3時間間隔
-async def periodic_check():
-    """3時間ごとに新規ツイートをチェック"""
-    await check_and_post_updates()
+def _last_check_age():
+    now = datetime.utcnow()
+    return {username: (now - checked_at).total_seconds() for username, checked_at in last_checked_at.items()}
 
-@periodic_check.before_loop
-async def before_periodic_check():
-    await bot.wait_until_ready()
-    
-    # 初期化を遅延実行（レート制限対策）
-    logger.info("Waiting 30 seconds before first check to stabilize connection...")
-    await asyncio.sleep(30)  # 30秒待機
-    
-    logger.info("Twitter API bot is ready, starting periodic checks...")
+
+FETCH_LATENCY = REGISTRY.register(Histogram(
+    "twitter_fetch_latency_seconds", "Time until Twitter API response headers arrive", ["endpoint"]))
+POST_LATENCY = REGISTRY.register(Histogram(
+    "discord_post_latency_seconds", "Time to deliver one batched Discord message"))
+EVENT_LOOP_LAG = REGISTRY.register(Gauge(
+    "event_loop_lag_seconds", "Delay of a periodic event loop tick beyond its schedule"))
+REGISTRY.register(Gauge(
+    "twitter_rate_limit_remaining", "Requests left in the current rate limit window", ["endpoint"],
+    collect=_rate_limit_remaining))
+REGISTRY.register(Gauge(
+    "twitter_rate_limit_reset_timestamp", "Epoch seconds when the rate limit window frees up", ["endpoint"],
+    collect=lambda: {name: limiter.next_reset() for name, limiter in rate_limiter.endpoints.items()}))
+REGISTRY.register(Gauge(
+    "twitter_budget_tweets_used", "Tweets billed in the current billing cycle",
+    collect=lambda: {(): budget_tracker.tweets}))
+REGISTRY.register(Gauge(
+    "twitter_budget_tweets_forecast", "Projected tweets billed by the end of the billing cycle",
+    collect=lambda: {(): budget_tracker.forecast()}))
+REGISTRY.register(Gauge(
+    "twitter_budget_tweets_limit", "Monthly tweet cap",
+    collect=lambda: {(): budget_tracker.monthly_limit}))
+REGISTRY.register(Gauge(
+    "account_last_tweet_age_seconds", "Seconds since the newest seen tweet of each account", ["account"],
+    collect=_last_tweet_age))
+REGISTRY.register(Gauge(
+    "account_last_check_age_seconds", "Seconds since each account was last fetched successfully", ["account"],
+    collect=_last_check_age))
+REGISTRY.register(Gauge(
+    "delivery_queue_depth", "Embeds waiting in each Discord delivery queue", ["channel"],
+    collect=lambda: {channel_id: queue.queue.qsize() for channel_id, queue in delivery_queues.items()}))
+REGISTRY.register(Gauge(
+    "poll_scheduler_overdue_seconds", "How far the oldest scheduled poll is past due",
+    collect=lambda: {(): poll_scheduler.overdue_seconds()}))
+REGISTRY.register(Gauge(
+    "stream_connected", "1 while connected to the filtered stream",
+    collect=lambda: {(): int(stream_consumer.connected)} if FETCH_MODE == "stream" else {}))
+STREAM_RECONNECTS = REGISTRY.register(Counter(
+    "stream_reconnects_total", "Times the filtered stream connection was lost and re-established"))
+REGISTRY.register(Gauge(
+    "stream_last_data_age_seconds", "Seconds since the last line (tweet or keep-alive) from the filtered stream",
+    collect=lambda: {(): time.time() - stream_consumer.last_data_at} if stream_consumer.last_data_at else {}))
+FILTERED_TWEETS = REGISTRY.register(Counter(
+    "filtered_tweets_total", "Tweets dropped by filter rules before any embed was built", ["account"]))
+DROPPED_DELIVERIES = REGISTRY.register(Counter(
+    "dropped_deliveries_total", "Tweets given up on for a channel after a permanent delivery error (403/4xx)",
+    ["account", "channel"]))
+REGISTRY.register(Gauge(
+    "circuit_breaker_open", "1 while a circuit is open, 0.5 while half-open (closed circuits are omitted)",
+    ["scope", "key"],
+    collect=lambda: {
+        (breakers.scope, key): 1 if breaker.state == "open" else 0.5
+        for breakers in (endpoint_breakers, account_breakers)
+        for key, breaker in breakers.open_circuits().items()
+    }))
+REGISTRY.register(Gauge(
+    "shard_owned_accounts", "Accounts leased to this worker", ["worker"],
+    collect=lambda: {shard_coordinator.worker_id: len(shard_coordinator.owned) if SHARDING else len(TARGET_ACCOUNTS)}))
+
+
+def readiness_check():
+    """ゲートウェイ接続とポーリングの状態から準備完了かを判定"""
+    reasons = []
+    if DELIVERY_MODE == "webhook":
+        if webhook_destinations.session is None or webhook_destinations.session.closed:
+            reasons.append("webhook session not started")
+    elif bot.is_closed() or not bot.is_ready() or math.isinf(bot.latency) or math.isnan(bot.latency):
+        reasons.append("discord gateway not connected")
+    if FETCH_MODE == "stream":
+        if stream_consumer.task is None or stream_consumer.task.done():
+            reasons.append("stream consumer not running")
+        elif shard_coordinator.is_leader() and not stream_consumer.connected:
+            reasons.append("filtered stream disconnected")
+    else:
+        if poll_scheduler.task is None or poll_scheduler.task.done():
+            reasons.append("poll scheduler not running")
+        overdue = poll_scheduler.overdue_seconds()
+        if overdue > POLL_STALL_SECONDS:
+            reasons.append(f"polling stalled ({overdue:.0f}s overdue)")
+    if SHARDING and (shard_coordinator.renewed_at is None or time.time() - shard_coordinator.renewed_at > SHARD_LEASE_TTL):
+        reasons.append("shard leases not renewed")
+    return not reasons, reasons
+
+
+async def monitor_event_loop_lag(interval=1.0):
+    """イベントループの遅延を計測してメトリクスに反映"""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.set(max(loop.time() - started - interval, 0.0))
+
+
+async def refresh_status_snapshot_periodically(interval=STATUS_REFRESH_INTERVAL):
+    """取得モードに関係なくステータス用スナップショットを定期的に作り直す"""
+    while True:
+        refresh_status_snapshot()
+        await asyncio.sleep(interval)
+
+
+health_runner = None
+loop_lag_task = None
+status_refresh_task = None
+
+async def start_services():
+    """共有HTTPセッション・ヘルスチェックサーバーを起動し、担当アカウントのリースを取得"""
+    global health_runner, loop_lag_task, status_refresh_task
+    await twitter_api.start()
+    health_runner = await keep_alive(readiness_check, REGISTRY.render, HEALTH_HOST, HEALTH_PORT)
+    loop_lag_task = asyncio.create_task(monitor_event_loop_lag())
+    status_refresh_task = asyncio.create_task(refresh_status_snapshot_periodically())
+    logger.info(f"Health/metrics server listening on {HEALTH_HOST}:{HEALTH_PORT}")
+
+    # 複数ワーカー構成なら担当アカウントのリースを取得
+    await shard_coordinator.start()
+
+
+def start_fetching():
+    """アダプティブポーリング開始（ストリームモードではストリームを購読）"""
+    logger.info(f"Destination channels: {all_destination_channel_ids()}")
+    logger.info(f"Monitoring accounts: {list(TARGET_ACCOUNTS.keys())}")
+    if FETCH_MODE == "stream":
+        stream_consumer.start()
+    else:
+        poll_scheduler.start()
+
+
+async def run_headless():
+    """ゲートウェイに接続せず、取得と Webhook 配信だけを行う（DELIVERY_MODE=webhook）"""
+    await start_services()
+    await webhook_destinations.start()
+    start_fetching()
+    logger.info("Running headless: delivering via webhooks, Discord gateway and commands disabled")
+    await asyncio.Event().wait()
+
+
+@bot.event
+async def setup_hook():
+    """ゲートウェイ接続前に共有HTTPセッション・ヘルスチェックサーバーを起動"""
+    await start_services()
+
+    # スラッシュコマンドを登録
+    try:
+        synced = await bot.tree.sync()
+        logger.info(f"Synced {len(synced)} slash commands")
+    except Exception as e:
+        logger.error(f"Failed to sync slash commands: {e}")
 
 @bot.event
 async def on_ready():
     logger.info(f"Bot logged in as {bot.user} (ID: {bot.user.id})")
-    logger.info(f"Target channel: {CHANNEL_ID}")
-    logger.info(f"Monitoring accounts: {list(TARGET_ACCOUNTS.keys())}")
-    
-    # 定期チェック開始
-    if not periodic_check.is_running():
-        periodic_check.start()
+    start_fetching()
+
+# 複数ワーカー構成ではリーダーだけがプレフィックスコマンドに応答する
+@bot.event
+async def on_message(message):
+    if shard_coordinator.is_leader():
+        await bot.process_commands(message)
 
 # 手動チェックコマンド
 @bot.command()
 async def check(ctx):
-    """手動でツイートチェックを実行"""
+    """手動でツイートチェックを実行（バックグラウンドジョブとして登録してすぐに応答）"""
     if ctx.author.guild_permissions.administrator:
-        await ctx.send("🔍 手動チェックを開始します...")
-        await check_and_post_updates()
-        await ctx.send("✅ チェック完了！")
+        job = start_check_job(str(ctx.author))
+        message = f"🔍 手動チェックを開始しました（ジョブ #{job.id}）。`!job {job.id}` で進捗を確認できます。"
+        if job.scope:
+            message += f"\n⚠️ {job.scope}"
+        await ctx.send(message)
     else:
         await ctx.send("❌ このコマンドは管理者のみ使用できます。")
 
+# ジョブ確認コマンド
+@bot.command()
+async def job(ctx, job_id: str = None):
+    """手動チェックジョブの進捗・結果を確認（ID省略時は最新）"""
+    check_job = find_job(job_id)
+    if check_job is None:
+        await ctx.send("❌ 該当するジョブが見つかりません。")
+        return
+    await ctx.send(embed=build_job_embed(check_job))
+
+# スラッシュコマンド版の手動チェック（応答を保留し、完了したら結果を通知）
+@bot.tree.command(name="check", description="手動でツイートチェックを実行します")
+@app_commands.default_permissions(administrator=True)
+async def slash_check(interaction: discord.Interaction):
+    permissions = getattr(interaction.user, "guild_permissions", None)
+    if not permissions or not permissions.administrator:
+        await interaction.response.send_message("❌ このコマンドは管理者のみ使用できます。", ephemeral=True)
+        return
+
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    check_job = start_check_job(str(interaction.user))
+    message = f"🔍 手動チェックを開始しました（ジョブ #{check_job.id}）。完了したらお知らせします。"
+    if check_job.scope:
+        message += f"\n⚠️ {check_job.scope}"
+    await interaction.followup.send(message, ephemeral=True)
+
+    try:
+        await asyncio.wait_for(asyncio.shield(check_job.task), timeout=SLASH_FOLLOWUP_TIMEOUT)
+    except asyncio.TimeoutError:
+        return
+    await interaction.followup.send(embed=build_job_embed(check_job), ephemeral=True)
+
+@bot.tree.command(name="job", description="手動チェックジョブの進捗を確認します")
+@app_commands.describe(job_id="ジョブID（省略時は最新）")
+async def slash_job(interaction: discord.Interaction, job_id: str = None):
+    check_job = find_job(job_id)
+    if check_job is None:
+        await interaction.response.send_message("❌ 該当するジョブが見つかりません。", ephemeral=True)
+        return
+    await interaction.response.send_message(embed=build_job_embed(check_job), ephemeral=True)
+
 # レート制限状況確認コマンド
 @bot.command()
 async def rate_status(ctx):
-    """レート制限状況を確認"""
+    """レート制限状況を確認（キャッシュ済みのスナップショットを表示）"""
+    snapshot = get_status_snapshot()
     embed = discord.Embed(title="📊 Twitter API レート制限状況", color=0x1DA1F2)
     
-    # 月間使用量
-    estimated_monthly_tweets = rate_limiter.monthly_count * 20
-    remaining_monthly = rate_limiter.monthly_limit - estimated_monthly_tweets
+    # 請求サイクルの実績と予測
     embed.add_field(
-        name="月間使用量",
-        value=f"リクエスト数: {rate_limiter.monthly_count}回\n"
-              f"推定ツイート数: {estimated_monthly_tweets:,}/{rate_limiter.monthly_limit:,}\n"
-              f"残り: {remaining_monthly:,}ツイート",
+        name="月間使用量（実績 / 予測）",
+        value=f"リクエスト数: {snapshot.requests}回\n"
+              f"取得ツイート数: {snapshot.tweets:,}/{snapshot.monthly_limit:,}\n"
+              f"サイクル末予測: {snapshot.forecast:,.0f}ツイート\n"
+              f"残り: {snapshot.remaining:,}ツイート",
         inline=False
     )
     
-    # 15分間のウィンドウ
-    now = datetime.now()
-    cutoff = now - timedelta(seconds=900)
-    recent_requests = [req for req in rate_limiter.requests if req > cutoff]
-    
-    embed.add_field(
-        name="15分間の使用量",
-        value=f"{len(recent_requests)}/10",
-        inline=True
-    )
+    # エンドポイントごとのウィンドウ
+    for name, used, limit, next_reset in snapshot.endpoints:
+        value = f"{used}/{limit}"
+        if next_reset:
+            value += f"\nリセット: <t:{int(next_reset)}:R>"
+        embed.add_field(name=f"{name} (15分)", value=value, inline=True)
     
-    # 次回リセット時刻
-    if rate_limiter.requests:
-        next_reset = rate_limiter.requests[0] + timedelta(seconds=900)
+    # 遮断中のエンドポイント・アカウント
+    if snapshot.open_circuits:
         embed.add_field(
-            name="次回リセット",
-            value=f"<t:{int(next_reset.timestamp())}:R>",
-            inline=True
+            name="⛔ 遮断中",
+            value="\n".join(
+                f"{scope} `{key}`: {state}" + (f"（あと{retry_after / 60:.0f}分）" if retry_after else "")
+                for scope, key, state, retry_after in snapshot.open_circuits[:10]
+            ),
+            inline=False
         )
     
-    # 月間リセット
-    month_reset = rate_limiter.month_start + timedelta(days=30)
+    # 請求サイクルのリセット
+    cycle_end = snapshot.cycle_end.replace(tzinfo=timezone.utc)
     embed.add_field(
         name="月間リセット",
-        value=f"<t:{int(month_reset.timestamp())}:D>",
+        value=f"<t:{int(cycle_end.timestamp())}:D>",
         inline=True
     )
+    embed.set_footer(text="集計時刻")
+    embed.timestamp = snapshot.taken_at.replace(tzinfo=timezone.utc)
     
     await ctx.send(embed=embed)
 
 # 権限チェックコマンド
 @bot.command()
 async def check_permissions(ctx):
-    """Bot権限の確認"""
-    channel = bot.get_channel(CHANNEL_ID)
-    if not channel:
-        await ctx.send("❌ 指定されたチャンネルが見つかりません。")
-        return
-    
-    bot_member = channel.guild.get_member(bot.user.id)
-    if not bot_member:
-        await ctx.send("❌ Botがサーバーに参加していません。")
+    """Bot権限の確認（全配信先チャンネル）"""
+    channel_ids = all_destination_channel_ids()
+    if not channel_ids:
+        await ctx.send("❌ 配信先チャンネルが設定されていません。")
         return
-    
-    permissions = channel.permissions_for(bot_member)
-    
-    embed = discord.Embed(title="🔐 Bot権限チェック", color=0x00ff00 if permissions.send_messages else 0xff0000)
-    embed.add_field(name="チャンネル", value=f"{channel.mention}", inline=False)
-    
-    required_perms = {
-        "メッセージを送信": permissions.send_messages,
-        "埋め込みリンク": permissions.embed_links,
-        "メッセージを読む": permissions.read_messages,
-        "メッセージ履歴を読む": permissions.read_message_history
-    }
-    
-    for perm_name, has_perm in required_perms.items():
-        status = "✅" if has_perm else "❌"
-        embed.add_field(name=perm_name, value=status, inline=True)
-    
-    if not all(required_perms.values()):
-        embed.add_field(
-            name="⚠️ 権限不足",
-            value="Botに必要な権限を付与してください。\n"
-                  "サーバー設定 → 連携サービス → Bot → 権限を編集",
-            inline=False
-        )
-    
-    await ctx.send(embed=embed)
+
+    for channel_id in channel_ids:
+        channel = bot.get_channel(channel_id)
+        if not channel:
+            await ctx.send(f"❌ 指定されたチャンネルが見つかりません。(ID: {channel_id})")
+            continue
+        
+        bot_member = channel.guild.get_member(bot.user.id)
+        if not bot_member:
+            await ctx.send(f"❌ Botがサーバーに参加していません。({channel.guild.name})")
+            continue
+        
+        permissions = channel.permissions_for(bot_member)
+        
+        embed = discord.Embed(title="🔐 Bot権限チェック", color=0x00ff00 if permissions.send_messages else 0xff0000)
+        embed.add_field(name="チャンネル", value=f"{channel.mention} ({channel.guild.name})", inline=False)
+        
+        required_perms = {
+            "メッセージを送信": permissions.send_messages,
+            "埋め込みリンク": permissions.embed_links,
+            "メッセージを読む": permissions.read_messages,
+            "メッセージ履歴を読む": permissions.read_message_history
+        }
+        
+        for perm_name, has_perm in required_perms.items():
+            status = "✅" if has_perm else "❌"
+            embed.add_field(name=perm_name, value=status, inline=True)
+        
+        if not all(required_perms.values()):
+            embed.add_field(
+                name="⚠️ 権限不足",
+                value="Botに必要な権限を付与してください。\n"
+                      "サーバー設定 → 連携サービス → Bot → 権限を編集",
+                inline=False
+            )
+        
+        await ctx.send(embed=embed)
 
 # 使用量計算表示コマンド
 @bot.command()
 async def usage(ctx):
-    """API使用量の詳細を表示"""
+    """API使用量の詳細を表示（実績と予測、キャッシュ済みのスナップショットを表示）"""
+    snapshot = get_status_snapshot()
     embed = discord.Embed(title="📊 API使用量分析", color=0x1DA1F2)
     
-    # 現在の設定
-    check_interval_hours = 3  # 3時間
-    accounts = len([v for v in TARGET_ACCOUNTS.values() if v is not None])
-    requests_per_check = accounts  # 各アカウント1リクエスト
-    tweets_per_request = 20
-    
-    # 1日の計算
-    checks_per_day = 24 / check_interval_hours
-    daily_requests = checks_per_day * requests_per_check
-    daily_tweets = daily_requests * tweets_per_request
-    
-    # 1ヶ月の計算
-    monthly_requests = daily_requests * 30
-    monthly_tweets = daily_tweets * 30
-    
-    # 制限との比較
-    monthly_tweet_limit = 10000
-    rate_limit_per_15min = 10
+    # 実績
+    tweets_per_request = snapshot.tweets / snapshot.requests if snapshot.requests else 0
+    cycle_start = snapshot.cycle_start.replace(tzinfo=timezone.utc)
     
     embed.add_field(
-        name="⚙️ 現在の設定",
-        value=f"チェック間隔: {check_interval_hours}時間\n"
-              f"監視アカウント: {accounts}個\n"
-              f"1リクエストあたり: {tweets_per_request}ツイート",
-        inline=False
+        name="📈 今サイクルの実績",
+        value=f"開始: <t:{int(cycle_start.timestamp())}:D>\n"
+              f"リクエスト数: {snapshot.requests}回\n"
+              f"取得ツイート数: {snapshot.tweets:,}件\n"
+              f"1リクエストあたり: {tweets_per_request:.1f}ツイート",
+        inline=True
     )
     
+    # 予測
+    ceiling = snapshot.monthly_limit * snapshot.spend_ceiling
     embed.add_field(
-        name="📅 1日あたり",
-        value=f"チェック回数: {checks_per_day:.1f}回\n"
-              f"リクエスト数: {daily_requests:.1f}回\n"
-              f"ツイート取得数: {daily_tweets:.1f}件",
+        name="🔮 サイクル末の予測",
+        value=f"1日あたり: {snapshot.daily_rate:.1f}ツイート\n"
+              f"予測使用量: {snapshot.forecast:,.0f}件\n"
+              f"上限（{snapshot.spend_ceiling:.0%}）: {ceiling:,.0f}件\n"
+              f"制限使用率: {(snapshot.forecast / snapshot.monthly_limit) * 100:.1f}%",
         inline=True
     )
     
+    # ポーリングへの反映
     embed.add_field(
-        name="📆 1ヶ月あたり",
-        value=f"リクエスト数: {monthly_requests:.0f}回\n"
-              f"ツイート取得数: {monthly_tweets:.0f}件\n"
-              f"制限使用率: {(monthly_tweets/monthly_tweet_limit)*100:.1f}%",
-        inline=True
+        name="⚙️ ポーリング",
+        value=f"監視アカウント: {snapshot.accounts_initialized}個\n"
+              f"平均チェック間隔: {snapshot.average_interval / 3600:.1f}時間\n"
+              f"予算による間隔倍率: ×{snapshot.pressure:.2f}",
+        inline=False
     )
     
+    # アカウント別の実績（多い順に上位5件）
+    if snapshot.top_accounts:
+        embed.add_field(
+            name="👤 アカウント別",
+            value="\n".join(
+                f"@{username}: {tweets:,}件 / {requests}回"
+                for username, tweets, requests in snapshot.top_accounts
+            ),
+            inline=False
+        )
+    
     embed.add_field(
-        name="✅ 無料プラン制限",
-        value=f"15分あたり: {rate_limit_per_15min}リクエスト\n"
-              f"月間ツイート: {monthly_tweet_limit:,}件\n"
-              f"**現在の設定は制限内です**" if monthly_tweets < monthly_tweet_limit else "**⚠️ 制限超過の恐れ**",
+        name="✅ 判定",
+        value="**現在のペースは制限内です**" if snapshot.forecast <= ceiling else "**⚠️ 制限超過の恐れ（チェック間隔を自動で延長中）**",
         inline=False
     )
+    embed.set_footer(text="集計時刻")
+    embed.timestamp = snapshot.taken_at.replace(tzinfo=timezone.utc)
     
     await ctx.send(embed=embed)
 
@@ -539,12 +3021,21 @@ async def user_ids(ctx):
 @bot.command()
 async def config(ctx):
     """Bot設定情報を表示"""
+    snapshot = get_status_snapshot()
     embed = discord.Embed(title="⚙️ Bot設定情報", color=0x00ff00)
-    embed.add_field(name="チェック間隔", value="3時間", inline=True)
-    embed.add_field(name="レート制限", value="10回/15分", inline=True)
-    embed.add_field(name="月間制限", value="10,000ツイート", inline=True)
-    embed.add_field(name="監視アカウント数", value=f"{len(TARGET_ACCOUNTS)}個", inline=True)
+    embed.add_field(
+        name="チェック間隔",
+        value=f"アダプティブ（{POLL_MIN_INTERVAL // 60}分〜{POLL_MAX_INTERVAL // 3600}時間）",
+        inline=True
+    )
+    embed.add_field(name="レート制限", value="APIヘッダに追従（エンドポイント別）", inline=True)
+    embed.add_field(name="月間制限", value=f"{snapshot.monthly_limit:,}ツイート", inline=True)
+    embed.add_field(name="監視アカウント数", value=f"{snapshot.accounts_total}個", inline=True)
+    embed.add_field(name="配信先チャンネル数", value=f"{snapshot.destination_count}個", inline=True)
+    embed.add_field(name="絞り込みルール", value=f"{len(tweet_filter)}件" if len(tweet_filter) else "なし", inline=True)
     embed.add_field(name="API バージョン", value="Twitter API v2", inline=True)
+    fetch_modes = {"search": "まとめて検索 (recent search)", "stream": "フィルタードストリーム"}
+    embed.add_field(name="取得モード", value=fetch_modes.get(FETCH_MODE, "タイムライン"), inline=True)
     embed.add_field(name="プラン", value="Basic (無料)", inline=True)
     embed.add_field(name="サービス", value="Background Worker", inline=True)
     embed.add_field(name="機能", value="ツイート本文 + 画像対応", inline=True)
@@ -555,13 +3046,31 @@ async def config(ctx):
 if __name__ == '__main__':
     logger.info("=== Starting Twitter API Discord Bot ===")
     logger.info(f"Monitoring accounts: {list(TARGET_ACCOUNTS.keys())}")
-    logger.info(f"Target channel ID: {CHANNEL_ID}")
+    logger.info(f"Destination channel IDs: {all_destination_channel_ids()}")
     logger.info("Using Twitter API v2 Basic (Free) plan limits")
-    logger.info("Rate limit: 10 requests per 15 minutes")
-    logger.info("Check interval: 3 hours")
+    logger.info("Rate limit: per endpoint, synced from x-rate-limit-* headers")
+    logger.info(f"Check interval: adaptive ({POLL_MIN_INTERVAL}s - {POLL_MAX_INTERVAL}s)")
     
+    async def main():
+        try:
+            if DELIVERY_MODE == "webhook":
+                await run_headless()
+            else:
+                async with bot:
+                    await bot.start(DISCORD_TOKEN)
+        finally:
+            # シャットダウン時に共有HTTPセッション・ヘルスチェックサーバーを確実に閉じる
+            await shard_coordinator.release()
+            await flush_state()
+            await twitter_api.close()
+            await webhook_destinations.close()
+            if health_runner is not None:
+                await health_runner.cleanup()
+
     try:
-        bot.run(DISCORD_TOKEN)
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        logger.info("Shutting down...")
     except Exception as e:
         logger.error(f"Failed to start bot: {e}")
         exit(1)
@@ -1,15 +1,40 @@
-from flask import Flask
-from threading import Thread
+from aiohttp import web
 
-app = Flask('')
 
-@app.route('/')
-def home():
-    return "Bot is alive!"
+def make_app(readiness_check, render_metrics):
+    """ヘルスチェック・メトリクス用の aiohttp アプリ
 
-def run():
-    app.run(host='0.0.0.0', port=8080)
+    readiness_check: () -> (準備完了か, 理由のリスト)
+    render_metrics: () -> Prometheus テキスト形式の文字列
+    """
+    app = web.Application()
 
-def keep_alive():
-    t = Thread(target=run)
-    t.start()
+    async def home(request):
+        return web.Response(text="Bot is alive!")
+
+    async def healthz(request):
+        return web.Response(text="ok")
+
+    async def ready(request):
+        is_ready, reasons = readiness_check()
+        if is_ready:
+            return web.Response(text="ready")
+        return web.Response(status=503, text="not ready: " + "; ".join(reasons))
+
+    async def metrics(request):
+        return web.Response(text=render_metrics(), content_type="text/plain", charset="utf-8")
+
+    app.router.add_get("/", home)
+    app.router.add_get("/healthz", healthz)
+    app.router.add_get("/ready", ready)
+    app.router.add_get("/metrics", metrics)
+    return app
+
+
+async def keep_alive(readiness_check, render_metrics, host="0.0.0.0", port=8080):
+    """Botと同じイベントループ上でHTTPサーバーを起動（停止用の runner を返す）"""
+    runner = web.AppRunner(make_app(readiness_check, render_metrics), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    return runner
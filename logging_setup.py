@@ -0,0 +1,111 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+
+class SamplingFilter(logging.Filter):
+    """sample_key 付きの繰り返しログを間引く
+
+    キーごとに window 秒あたり burst 件までは全て出力し、それを超えた分は every 件に1件だけ出力する。
+    間引いた件数は次に出力するレコードの suppressed に載せる。sample_key の無いレコードは常に通す。
+    """
+
+    def __init__(self, burst=20, window=60.0, every=100):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self.every = every
+        self.counters = {}  # sample_key -> [ウィンドウ開始時刻, ウィンドウ内の件数, 間引いた件数]
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        key = getattr(record, "sample_key", None)
+        if key is None or record.levelno >= logging.WARNING:
+            return True
+
+        now = time.monotonic()
+        with self.lock:
+            counter = self.counters.get(key)
+            if counter is None or now - counter[0] >= self.window:
+                suppressed = counter[2] if counter else 0
+                counter = [now, 0, suppressed]
+                self.counters[key] = counter
+            counter[1] += 1
+            if counter[1] > self.burst and (counter[1] - self.burst) % self.every:
+                counter[2] += 1
+                return False
+            record.suppressed = counter[2]
+            counter[2] = 0
+        return True
+
+
+class TruncatingQueueHandler(logging.handlers.QueueHandler):
+    """キューに積む前にメッセージを確定し、長すぎる本文（レスポンスボディ等）を切り詰める"""
+
+    def __init__(self, log_queue, max_length):
+        super().__init__(log_queue)
+        self.max_length = max_length
+
+    def prepare(self, record):
+        record = super().prepare(record)
+        if self.max_length and len(record.msg) > self.max_length:
+            omitted = len(record.msg) - self.max_length
+            record.msg = record.message = f"{record.msg[:self.max_length]}…(+{omitted} chars)"
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """1行1レコードのJSON形式"""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        sample_key = getattr(record, "sample_key", None)
+        if sample_key is not None:
+            entry["sample_key"] = sample_key
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            entry["suppressed"] = suppressed
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def sampled(key):
+    """間引き対象のログに渡す extra（例: logger.info("...", extra=sampled("rate_limit_info"))）"""
+    return {"sample_key": key}
+
+
+def setup_logging(level="INFO", fmt="json", max_length=2000, burst=20, window=60.0, every=100):
+    """ルートロガーの出力をキュー経由で別スレッドに移す（イベントループ上では書き込みを行わない）
+
+    戻り値は起動済みの QueueListener（終了時に自動で stop される）。
+    """
+    output = logging.StreamHandler(sys.stdout)
+    if fmt == "json":
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = TruncatingQueueHandler(log_queue, max_length)
+    queue_handler.addFilter(SamplingFilter(burst, window, every))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,134 @@
+import math
+import time
+
+
+class Histogram:
+    """Prometheus 形式のヒストグラム（ラベル別に累積バケットを保持）"""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self.series = {}  # ラベル値のタプル -> [バケットごとの件数, 合計, 件数]
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        series = self.series.get(key)
+        if series is None:
+            series = [[0] * len(self.buckets), 0.0, 0]
+            self.series[key] = series
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[0][i] += 1
+        series[1] += value
+        series[2] += 1
+
+    def time(self, **labels):
+        """with 文で処理時間を計測"""
+        return _Timer(self, labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in self.series.items():
+            for bound, bucket_count in zip(self.buckets, counts):
+                le = "+Inf" if bound == math.inf else repr(float(bound))
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le=le)} {bucket_count}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Counter:
+    """Prometheus 形式のカウンター（単調増加、プロセス再起動で0に戻る）"""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for key, value in self.values.items():
+            lines.append(f"{self.name}{_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Gauge:
+    """Prometheus 形式のゲージ（collect を渡すと出力時に値を取得する）"""
+
+    def __init__(self, name, documentation, labelnames=(), collect=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.collect = collect  # () -> {ラベル値のタプル: 値}
+        self.values = {}
+
+    def set(self, value, **labels):
+        self.values[tuple(str(labels.get(name, "")) for name in self.labelnames)] = value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        values = self.values
+        if self.collect is not None:
+            values = {
+                tuple(str(part) for part in (key if isinstance(key, tuple) else (key,))): value
+                for key, value in self.collect().items()
+            }
+        for key, value in values.items():
+            if value is None:
+                continue
+            lines.append(f"{self.name}{_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """全メトリクスを Prometheus テキスト形式で出力"""
+        lines = []
+        for metric in self.metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                lines.append(f"# error rendering {metric.name}: {e}")
+        return "\n".join(lines) + "\n"
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+def _labels(labelnames, values, **extra):
+    pairs = list(zip(labelnames, values)) + list(extra.items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+REGISTRY = Registry()
@@ -0,0 +1,253 @@
+import asyncio
+import functools
+import json
+import math
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+
+class StateStore:
+    """ユーザーID・最終ツイートID・レート制限カウンタを保存するSQLiteストア（WALモード）
+
+    起動時の読み込み以外は run() で専用の1スレッドから実行し、ロック待ちでイベントループを止めない。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="state-store")
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS accounts (
+                username TEXT PRIMARY KEY,
+                user_id TEXT,
+                last_tweet_id TEXT,
+                last_checked_at TEXT,
+                skip_until TEXT,
+                search_since_id TEXT
+            )
+            """
+        )
+        # 旧バージョンで作成したDBには列を追加する
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(accounts)")}
+        if "search_since_id" not in columns:
+            self.conn.execute("ALTER TABLE accounts ADD COLUMN search_since_id TEXT")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS kv (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            )
+            """
+        )
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS workers (
+                worker_id TEXT PRIMARY KEY,
+                heartbeat_at REAL NOT NULL
+            )
+            """
+        )
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS leases (
+                username TEXT PRIMARY KEY,
+                worker_id TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+            """
+        )
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS budget_usage (
+                cycle_start TEXT NOT NULL,
+                day TEXT NOT NULL,
+                requests INTEGER NOT NULL DEFAULT 0,
+                tweets INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (cycle_start, day)
+            )
+            """
+        )
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS spilled_tweets (
+                username TEXT NOT NULL,
+                tweet_id INTEGER NOT NULL,
+                payload TEXT NOT NULL,
+                PRIMARY KEY (username, tweet_id)
+            )
+            """
+        )
+
+    async def run(self, func, *args, **kwargs):
+        """ストアの操作を書き込み用スレッドで実行（呼び出し順に1件ずつ処理される）"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    def load_accounts(self):
+        """保存済みのアカウント状態を {username: {...}} で返す"""
+        rows = self.conn.execute(
+            "SELECT username, user_id, last_tweet_id, last_checked_at, skip_until, search_since_id FROM accounts"
+        ).fetchall()
+        return {
+            username: {
+                "user_id": user_id,
+                "last_tweet_id": last_tweet_id,
+                "last_checked_at": _parse_datetime(last_checked_at),
+                "skip_until": _parse_datetime(skip_until),
+                "search_since_id": search_since_id,
+            }
+            for username, user_id, last_tweet_id, last_checked_at, skip_until, search_since_id in rows
+        }
+
+    def save_account(self, username, user_id=None, last_tweet_id=None, last_checked_at=None, skip_until=None,
+                     search_since_id=None):
+        """1アカウント分の状態を保存"""
+        self.save([(username, user_id, last_tweet_id, last_checked_at, skip_until, search_since_id)], {})
+
+    def save(self, accounts, values):
+        """複数アカウントの状態とkv値を1トランザクションで保存
+
+        accounts: [(username, user_id, last_tweet_id, last_checked_at, skip_until, search_since_id)]
+        values: {key: JSON化できる値}
+        """
+        self.conn.execute("BEGIN")
+        try:
+            self.conn.executemany(
+                """
+                INSERT INTO accounts (username, user_id, last_tweet_id, last_checked_at, skip_until, search_since_id)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(username) DO UPDATE SET
+                    user_id = excluded.user_id,
+                    last_tweet_id = excluded.last_tweet_id,
+                    last_checked_at = excluded.last_checked_at,
+                    skip_until = excluded.skip_until,
+                    search_since_id = excluded.search_since_id
+                """,
+                [
+                    (username, user_id, last_tweet_id, _format_datetime(last_checked_at), _format_datetime(skip_until),
+                     search_since_id)
+                    for username, user_id, last_tweet_id, last_checked_at, skip_until, search_since_id in accounts
+                ],
+            )
+            for key, value in values.items():
+                self.set_json(key, value)
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def get_json(self, key, default=None):
+        """kvテーブルからJSON値を取得"""
+        row = self.conn.execute("SELECT value FROM kv WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set_json(self, key, value):
+        """kvテーブルにJSON値を保存"""
+        self.conn.execute(
+            "INSERT INTO kv (key, value) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, json.dumps(value)),
+        )
+
+    def renew_leases(self, worker_id, usernames, ttl, keep=()):
+        """ハートビートを記録し、担当アカウントのリースを更新・取得する
+
+        担当数は生存ワーカー数で均等に割った数。多く持ちすぎている場合は keep 以外から手放す。
+        戻り値は (担当アカウントの集合, 生存ワーカーIDのリスト)。
+        """
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            self.conn.execute(
+                "INSERT INTO workers (worker_id, heartbeat_at) VALUES (?, ?) "
+                "ON CONFLICT(worker_id) DO UPDATE SET heartbeat_at = excluded.heartbeat_at",
+                (worker_id, now),
+            )
+            self.conn.execute("DELETE FROM workers WHERE heartbeat_at < ?", (now - ttl,))
+            self.conn.execute("DELETE FROM leases WHERE expires_at < ?", (now,))
+            workers = [row[0] for row in self.conn.execute("SELECT worker_id FROM workers ORDER BY worker_id")]
+
+            leased = dict(self.conn.execute("SELECT username, worker_id FROM leases").fetchall())
+            owned = sorted(username for username in usernames if leased.get(username) == worker_id)
+            target = math.ceil(len(usernames) / len(workers)) if usernames else 0
+
+            # 持ちすぎている分を手放す（チェック中のアカウントは次回に回す）
+            excess = len(owned) - target
+            if excess > 0:
+                released = [username for username in reversed(owned) if username not in keep][:excess]
+                self.conn.executemany(
+                    "DELETE FROM leases WHERE username = ? AND worker_id = ?",
+                    [(username, worker_id) for username in released],
+                )
+                owned = [username for username in owned if username not in released]
+
+            # 空いているアカウントを担当数まで取得
+            free = [username for username in usernames if username not in leased]
+            owned += free[:max(target - len(owned), 0)]
+            self.conn.executemany(
+                "INSERT INTO leases (username, worker_id, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(username) DO UPDATE SET expires_at = excluded.expires_at",
+                [(username, worker_id, now + ttl) for username in owned],
+            )
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        return set(owned), workers
+
+    def release_leases(self, worker_id):
+        """ワーカーのリースとハートビートを削除"""
+        self.conn.execute("DELETE FROM leases WHERE worker_id = ?", (worker_id,))
+        self.conn.execute("DELETE FROM workers WHERE worker_id = ?", (worker_id,))
+
+    def add_budget_usage(self, cycle_start, usage):
+        """日別の実績（{日付: [リクエスト数, ツイート数]}）を共有カウンタに加算"""
+        self.conn.executemany(
+            "INSERT INTO budget_usage (cycle_start, day, requests, tweets) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(cycle_start, day) DO UPDATE SET "
+            "requests = requests + excluded.requests, tweets = tweets + excluded.tweets",
+            [(cycle_start, day, requests, tweets) for day, (requests, tweets) in usage.items()],
+        )
+
+    def budget_usage(self, cycle_start):
+        """請求サイクルの日別実績を {日付: (リクエスト数, ツイート数)} で返す"""
+        rows = self.conn.execute(
+            "SELECT day, requests, tweets FROM budget_usage WHERE cycle_start = ?", (cycle_start,)
+        ).fetchall()
+        return {day: (requests, tweets) for day, requests, tweets in rows}
+
+    def spill_tweets(self, username, tweets):
+        """キャッチアップ中のツイートを一時保存（tweets は (ツイートID, JSON化できる値) のリスト）"""
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO spilled_tweets (username, tweet_id, payload) VALUES (?, ?, ?)",
+            [(username, tweet_id, json.dumps(payload)) for tweet_id, payload in tweets],
+        )
+
+    def load_spilled_tweets(self, username, after_id, limit):
+        """一時保存したツイートのうち after_id より新しいものを古い順に limit 件返す（[(ツイートID, 値)]）"""
+        rows = self.conn.execute(
+            "SELECT tweet_id, payload FROM spilled_tweets WHERE username = ? AND tweet_id > ? "
+            "ORDER BY tweet_id LIMIT ?",
+            (username, after_id, limit),
+        ).fetchall()
+        return [(tweet_id, json.loads(payload)) for tweet_id, payload in rows]
+
+    def clear_spilled_tweets(self, username):
+        self.conn.execute("DELETE FROM spilled_tweets WHERE username = ?", (username,))
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.conn.close()
+
+
+def _format_datetime(value):
+    return value.isoformat() if value else None
+
+
+def _parse_datetime(value):
+    return datetime.fromisoformat(value) if value else None
@@ -0,0 +1,138 @@
+import re
+from collections import deque
+
+
+class KeywordAutomaton:
+    """Aho-Corasick オートマトン（全キーワードを1回の走査で検出、計算量は本文長＋一致数に比例）"""
+
+    def __init__(self, keywords):
+        # keywords: [(キーワード, 識別子)]、キーワードは小文字化済み
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        for keyword, term_id in keywords:
+            node = 0
+            for char in keyword:
+                next_node = self.goto[node].get(char)
+                if next_node is None:
+                    next_node = len(self.goto)
+                    self.goto[node][char] = next_node
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                node = next_node
+            self.output[node].append(term_id)
+
+        # 幅優先で失敗リンクを張り、失敗先の出力を引き継ぐ
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def search(self, text):
+        """text に含まれるキーワードの識別子の集合"""
+        found = set()
+        node = 0
+        goto, fail, output = self.goto, self.fail, self.output
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if output[node]:
+                found.update(output[node])
+        return found
+
+
+class TweetFilter:
+    """アカウント別・チャンネル別の絞り込みルールを1つのマッチャーにまとめたもの
+
+    ルールは {"include": [...], "exclude": [...], "media_only": bool}。
+    include はいずれかに一致したツイートだけを通し、exclude はいずれかに一致したツイートを落とす。
+    語は大文字小文字を区別しない部分一致で、"re:" で始まる語は正規表現として扱う。
+    全ルールのキーワードは1つの Aho-Corasick オートマトンにまとめ、本文の走査は1回だけにする。
+    正規表現は1つずつコンパイルし（インラインフラグや後方参照もそのまま使える）、判定中のルールが参照するものだけを
+    必要になった時点で評価する。結果はツイートごとに覚えておくので、同じ正規表現を2回評価することはない。
+    """
+
+    def __init__(self, account_rules=None, channel_rules=None):
+        # ("account", username) / ("channel", channel_id) ->
+        #     (include のキーワード識別子, include の正規表現識別子, exclude のキーワード識別子, exclude の正規表現識別子, media_only)
+        self.rules = {}
+        self.patterns = {}  # 正規表現の識別子 -> コンパイル済みパターン
+        keywords = []
+        term_ids = {}       # 語 -> 識別子（同じ語はルールをまたいで共有）
+
+        def register(term, scope, key):
+            term_id = term_ids.get(term)
+            if term_id is None:
+                term_id = len(term_ids)
+                if term.startswith("re:"):
+                    try:
+                        self.patterns[term_id] = re.compile(term[3:], re.IGNORECASE)
+                    except re.error as e:
+                        raise ValueError(f"Invalid regex {term[3:]!r} in {scope} filter for {key}: {e}") from None
+                else:
+                    keywords.append((term.casefold(), term_id))
+                term_ids[term] = term_id
+            return term_id
+
+        def split(term_ids_):
+            return (
+                frozenset(term_id for term_id in term_ids_ if term_id not in self.patterns),
+                tuple(term_id for term_id in term_ids_ if term_id in self.patterns),
+            )
+
+        for scope, rules in (("account", account_rules or {}), ("channel", channel_rules or {})):
+            for key, rule in rules.items():
+                include = dict.fromkeys(register(term, scope, key) for term in rule.get("include", []))
+                exclude = dict.fromkeys(register(term, scope, key) for term in rule.get("exclude", []))
+                self.rules[(scope, key)] = (*split(include), *split(exclude), bool(rule.get("media_only", False)))
+
+        self.automaton = KeywordAutomaton(keywords) if keywords else None
+
+    def __len__(self):
+        return len(self.rules)
+
+    def _regex_matches(self, term_ids, text, cache):
+        """term_ids のいずれかの正規表現が text に一致するか（評価結果は cache に残す）"""
+        for term_id in term_ids:
+            hit = cache.get(term_id)
+            if hit is None:
+                hit = cache[term_id] = self.patterns[term_id].search(text) is not None
+            if hit:
+                return True
+        return False
+
+    def _allows(self, rule, text, keywords, cache, has_media):
+        include_keywords, include_regexes, exclude_keywords, exclude_regexes, media_only = rule
+        if media_only and not has_media:
+            return False
+        if not exclude_keywords.isdisjoint(keywords) or self._regex_matches(exclude_regexes, text, cache):
+            return False
+        if not include_keywords and not include_regexes:
+            return True
+        return not include_keywords.isdisjoint(keywords) or self._regex_matches(include_regexes, text, cache)
+
+    def accepted_channels(self, username, tweet, channel_ids):
+        """ツイートを配信してよいチャンネルIDのリスト（キーワードの走査は1回、正規表現は必要な分だけ）"""
+        account_rule = self.rules.get(("account", username))
+        channel_rules = {channel_id: self.rules.get(("channel", channel_id)) for channel_id in channel_ids}
+        if account_rule is None and not any(channel_rules.values()):
+            return list(channel_ids)
+
+        text = tweet.text
+        keywords = self.automaton.search(text.casefold()) if self.automaton else set()
+        cache = {}
+        has_media = tweet.has_media
+        if account_rule is not None and not self._allows(account_rule, text, keywords, cache, has_media):
+            return []
+        return [
+            channel_id for channel_id, rule in channel_rules.items()
+            if rule is None or self._allows(rule, text, keywords, cache, has_media)
+        ]